@@ -0,0 +1,187 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import pypdf
+from pypdf import PdfReader
+
+from check_bounding_boxes import get_bounding_box_messages
+from extract_form_field_info import FIELD_INFO_CACHE_ENV_VAR, get_field_info, get_field_info_cached
+from fill_fillable_fields import fill_pdf_fields, monkeypatch_pydpf_method
+from fill_pdf_form_with_annotations import fill_pdf_form
+from synthetic_forms import make_field_values, make_fields_json, make_fillable_form, make_text_pdf
+
+
+# Times the main steps of the forms.md workflow on synthetic inputs (see synthetic_forms.py)
+# at several scales. Results can be saved as a baseline and later runs compared against it:
+#   python benchmark.py --save baseline.json
+#   (make a change)
+#   python benchmark.py --compare baseline.json
+
+
+# (pages, fields per page) for each scale.
+SCALES = {
+    "small": (1, 20),
+    "medium": (10, 50),
+    "large": (50, 100),
+}
+
+# Changes smaller than this fraction of the baseline time are reported as unchanged.
+NOISE_THRESHOLD = 0.1
+
+
+# Returns a function that calls `fn` with `args` and `kwargs` with the field info cache in
+# `cache_dir`, or turned off if it's None, whatever PDF_FIELD_INFO_CACHE is set to. The
+# environment is restored after each call.
+def with_field_info_cache(fn, cache_dir, *args, **kwargs):
+    def run():
+        with mock.patch.dict(os.environ):
+            os.environ.pop(FIELD_INFO_CACHE_ENV_VAR, None)
+            if cache_dir:
+                os.environ[FIELD_INFO_CACHE_ENV_VAR] = cache_dir
+            return fn(*args, **kwargs)
+    return run
+
+
+# Creates the inputs for one scale in `workdir` and returns a list of (name, function)
+# benchmarks. Each function runs the step once.
+def make_benchmarks(workdir, pages, fields_per_page):
+    form_pdf = os.path.join(workdir, "form.pdf")
+    text_pdf = os.path.join(workdir, "text.pdf")
+    fields_json = os.path.join(workdir, "fields.json")
+    field_values_json = os.path.join(workdir, "field_values.json")
+    output_pdf = os.path.join(workdir, "output.pdf")
+    images_dir = os.path.join(workdir, "images")
+    cache_dir = os.path.join(workdir, "field_info_cache")
+    os.makedirs(images_dir)
+
+    make_fillable_form(form_pdf, pages, fields_per_page)
+    make_text_pdf(text_pdf, pages)
+    with open(fields_json, "w") as f:
+        json.dump(make_fields_json(pages, fields_per_page), f)
+    with open(field_values_json, "w") as f:
+        json.dump(make_field_values(get_field_info(PdfReader(form_pdf))), f)
+    # The "_cached" benchmarks run with a warm field info cache, as when filling after
+    # extracting with --cache-dir; the others take the default path, without the cache.
+    with_field_info_cache(get_field_info_cached, cache_dir, form_pdf)()
+
+    def check_bounding_boxes():
+        with open(fields_json) as f:
+            get_bounding_box_messages(f)
+
+    benchmarks = [
+        ("get_bounding_box_messages", check_bounding_boxes),
+        ("get_field_info", lambda: get_field_info(PdfReader(form_pdf))),
+        ("fill_pdf_fields", with_field_info_cache(fill_pdf_fields, None, form_pdf, field_values_json, output_pdf)),
+        ("fill_pdf_fields_cached", with_field_info_cache(fill_pdf_fields, cache_dir, form_pdf, field_values_json, output_pdf)),
+        ("fill_pdf_fields_lazy", with_field_info_cache(fill_pdf_fields, None, form_pdf, field_values_json, output_pdf, lazy=True)),
+        ("fill_pdf_fields_lazy_cached", with_field_info_cache(fill_pdf_fields, cache_dir, form_pdf, field_values_json, output_pdf, lazy=True)),
+        ("fill_pdf_form", lambda: fill_pdf_form(text_pdf, fields_json, output_pdf)),
+    ]
+    # Rasterizing needs poppler.
+    if shutil.which("pdftoppm"):
+        from convert_pdf_to_images import convert
+        benchmarks.append(("convert", lambda: convert(text_pdf, images_dir)))
+    return benchmarks
+
+
+# Runs `fn` `repeat` times with its output suppressed and returns the wall times in seconds.
+def time_runs(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+    return times
+
+
+def run_benchmarks(scales, repeat=5, only=None):
+    results = []
+    for scale in scales:
+        pages, fields_per_page = SCALES[scale]
+        with tempfile.TemporaryDirectory() as workdir:
+            for name, fn in make_benchmarks(workdir, pages, fields_per_page):
+                if only and not any(pattern in name for pattern in only):
+                    continue
+                times = time_runs(fn, repeat)
+                result = {
+                    "benchmark": name,
+                    "scale": scale,
+                    "pages": pages,
+                    "fields_per_page": fields_per_page,
+                    "repeat": repeat,
+                    "min_s": min(times),
+                    "median_s": statistics.median(times),
+                }
+                print(f"{name:28} {scale:8} min {result['min_s']:9.4f}s  median {result['median_s']:9.4f}s", file=sys.stderr)
+                results.append(result)
+    return results
+
+
+def environment_info():
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pypdf": pypdf.__version__,
+        "numpy": numpy_version,
+        "cpu_count": os.cpu_count(),
+    }
+
+
+# Prints each result's min time next to the baseline's, with the ratio between them.
+def compare_to_baseline(results, baseline):
+    baseline_times = {(r["benchmark"], r["scale"]): r["min_s"] for r in baseline["results"]}
+    for result in results:
+        key = (result["benchmark"], result["scale"])
+        if key not in baseline_times:
+            print(f"{key[0]:28} {key[1]:8} {result['min_s']:9.4f}s  (not in baseline)")
+            continue
+        ratio = result["min_s"] / baseline_times[key]
+        if ratio > 1 + NOISE_THRESHOLD:
+            verdict = "slower"
+        elif ratio < 1 - NOISE_THRESHOLD:
+            verdict = "faster"
+        else:
+            verdict = "unchanged"
+        print(f"{key[0]:28} {key[1]:8} {result['min_s']:9.4f}s  baseline {baseline_times[key]:9.4f}s  x{ratio:5.2f}  {verdict}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times the PDF form scripts on synthetic inputs.")
+    parser.add_argument("--scales", default="small,medium",
+                        help=f"comma-separated scales to run, from {', '.join(SCALES)}")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each benchmark; the minimum is compared")
+    parser.add_argument("--only", action="append", help="only run benchmarks whose name contains this (repeatable)")
+    parser.add_argument("--save", help="write the results as a baseline JSON file")
+    parser.add_argument("--compare", help="compare the results against a baseline JSON file")
+    args = parser.parse_args()
+
+    scales = args.scales.split(",")
+    for scale in scales:
+        if scale not in SCALES:
+            parser.error(f"unknown scale {scale!r}")
+    monkeypatch_pydpf_method()
+    results = run_benchmarks(scales, repeat=args.repeat, only=args.only)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"environment": environment_info(), "results": results}, f, indent=2)
+        print(f"Saved {len(results)} results to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare_to_baseline(results, json.load(f))
@@ -1,7 +1,17 @@
 from dataclasses import dataclass
+import heapq
+import itertools
 import json
+import os
 import sys
 
+import pdf_profile
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 # Script to check that the `fields.json` file that Claude creates when analyzing PDFs
 # does not have overlapping bounding boxes. See forms.md.
@@ -14,57 +24,328 @@ class RectAndField:
     field: dict
 
 
+def rects_intersect(r1, r2):
+    disjoint_horizontal = r1[0] >= r2[2] or r1[2] <= r2[0]
+    disjoint_vertical = r1[1] >= r2[3] or r1[3] <= r2[1]
+    return not (disjoint_horizontal or disjoint_vertical)
+
+
+# Returns a dict mapping each index in `rects_and_fields` to the sorted indices of later
+# rects on the same page that intersect it. Rects are bucketed by page and each page is
+# swept top to bottom, so only rects whose vertical extents overlap are compared; this is
+# roughly O(N log N + K) for K intersections instead of comparing every pair.
+def find_intersections(rects_and_fields: list[RectAndField]) -> dict[int, list[int]]:
+    indices_by_page = {}
+    for i, rf in enumerate(rects_and_fields):
+        indices_by_page.setdefault(rf.field["page_number"], []).append(i)
+
+    intersections = {}
+    for indices in indices_by_page.values():
+        indices.sort(key=lambda i: rects_and_fields[i].rect[1])
+        # Heap of (bottom, index) for rects that may still overlap the sweep position.
+        active = []
+        for i in indices:
+            rect = rects_and_fields[i].rect
+            while active and active[0][0] <= rect[1]:
+                heapq.heappop(active)
+            for _, j in active:
+                lo, hi = min(i, j), max(i, j)
+                if rects_intersect(rects_and_fields[lo].rect, rects_and_fields[hi].rect):
+                    intersections.setdefault(lo, []).append(hi)
+            heapq.heappush(active, (rect[3], i))
+
+    for hits in intersections.values():
+        hits.sort()
+    return intersections
+
+
+def _rect_and_field(form_fields, rect_index) -> RectAndField:
+    # Rect indices interleave each field's label and entry boxes: 2k is the label of
+    # field k and 2k + 1 is its entry.
+    field = form_fields[rect_index // 2]
+    if rect_index % 2 == 0:
+        return RectAndField(field["label_bounding_box"], "label", field)
+    return RectAndField(field["entry_bounding_box"], "entry", field)
+
+
+def _entry_too_short(rf: RectAndField) -> bool:
+    if "entry_text" not in rf.field:
+        return False
+    return rf.rect[3] - rf.rect[1] < rf.field["entry_text"].get("font_size", 14)
+
+
+# Yields failure messages in the order of a pairwise scan over all rects: each rect's
+# intersections with later rects, followed by the height check if it's an entry.
+# `intersecting_pairs` must be sorted (i, j) rect indices with i < j, and `short_entries`
+# sorted rect indices of entries that are too short for their font size.
+def _failure_messages(form_fields, intersecting_pairs, short_entries):
+    events = heapq.merge(
+        ((i, 0, j) for i, j in intersecting_pairs),
+        ((i, 1, -1) for i in short_entries),
+    )
+    for i, kind, j in events:
+        ri = _rect_and_field(form_fields, i)
+        if kind == 0:
+            rj = _rect_and_field(form_fields, j)
+            if ri.field is rj.field:
+                yield f"FAILURE: intersection between label and entry bounding boxes for `{ri.field['description']}` ({ri.rect}, {rj.rect})"
+            else:
+                yield f"FAILURE: intersection between {ri.rect_type} bounding box for `{ri.field['description']}` ({ri.rect}) and {rj.rect_type} bounding box for `{rj.field['description']}` ({rj.rect})"
+        else:
+            font_size = ri.field["entry_text"].get("font_size", 14)
+            entry_height = ri.rect[3] - ri.rect[1]
+            yield f"FAILURE: entry bounding box height ({entry_height}) for `{ri.field['description']}` is too short for the text content (font size: {font_size}). Increase the box height or decrease the font size."
+
+
+def _build_messages(form_fields, intersecting_pairs, short_entries) -> list[str]:
+    messages = [f"Read {len(form_fields)} fields"]
+    # Output is capped at 20 lines, so at most 19 failures are ever reported.
+    failures = list(itertools.islice(_failure_messages(form_fields, intersecting_pairs, short_entries), 19))
+    messages.extend(failures)
+    if len(messages) >= 20:
+        messages.append("Aborting further checks; fix bounding boxes and try again")
+    elif not failures:
+        messages.append("SUCCESS: All bounding boxes are valid")
+    return messages
+
+
+def _messages_for_fields(form_fields) -> list[str]:
+    rects_and_fields = [_rect_and_field(form_fields, i) for i in range(2 * len(form_fields))]
+    intersections = find_intersections(rects_and_fields)
+    intersecting_pairs = ((i, j) for i in sorted(intersections) for j in intersections[i])
+    short_entries = (i for i in range(1, len(rects_and_fields), 2) if _entry_too_short(rects_and_fields[i]))
+    return _build_messages(form_fields, intersecting_pairs, short_entries)
+
+
 # Returns a list of messages that are printed to stdout for Claude to read.
 def get_bounding_box_messages(fields_json_stream) -> list[str]:
-    messages = []
-    fields = json.load(fields_json_stream)
-    messages.append(f"Read {len(fields['form_fields'])} fields")
-
-    def rects_intersect(r1, r2):
-        disjoint_horizontal = r1[0] >= r2[2] or r1[2] <= r2[0]
-        disjoint_vertical = r1[1] >= r2[3] or r1[3] <= r2[1]
-        return not (disjoint_horizontal or disjoint_vertical)
-
-    rects_and_fields = []
-    for f in fields["form_fields"]:
-        rects_and_fields.append(RectAndField(f["label_bounding_box"], "label", f))
-        rects_and_fields.append(RectAndField(f["entry_bounding_box"], "entry", f))
-
-    has_error = False
-    for i, ri in enumerate(rects_and_fields):
-        # This is O(N^2); we can optimize if it becomes a problem.
-        for j in range(i + 1, len(rects_and_fields)):
-            rj = rects_and_fields[j]
-            if ri.field["page_number"] == rj.field["page_number"] and rects_intersect(ri.rect, rj.rect):
-                has_error = True
-                if ri.field is rj.field:
-                    messages.append(f"FAILURE: intersection between label and entry bounding boxes for `{ri.field['description']}` ({ri.rect}, {rj.rect})")
-                else:
-                    messages.append(f"FAILURE: intersection between {ri.rect_type} bounding box for `{ri.field['description']}` ({ri.rect}) and {rj.rect_type} bounding box for `{rj.field['description']}` ({rj.rect})")
-                if len(messages) >= 20:
-                    messages.append("Aborting further checks; fix bounding boxes and try again")
-                    return messages
-        if ri.rect_type == "entry":
-            if "entry_text" in ri.field:
-                font_size = ri.field["entry_text"].get("font_size", 14)
-                entry_height = ri.rect[3] - ri.rect[1]
-                if entry_height < font_size:
-                    has_error = True
-                    messages.append(f"FAILURE: entry bounding box height ({entry_height}) for `{ri.field['description']}` is too short for the text content (font size: {font_size}). Increase the box height or decrease the font size.")
-                    if len(messages) >= 20:
-                        messages.append("Aborting further checks; fix bounding boxes and try again")
-                        return messages
-
-    if not has_error:
-        messages.append("SUCCESS: All bounding boxes are valid")
+    with pdf_profile.phase("parse"):
+        fields = json.load(fields_json_stream)
+    with pdf_profile.phase("validate"):
+        return _messages_for_fields(fields["form_fields"])
+
+
+# Incremental checks keep the previous run's results in a hidden sidecar file next to the
+# `fields.json` file. When only a few fields have changed since then, intersections are only
+# re-checked for the boxes of those fields, against the boxes near them on the same page
+# (found through a grid of `GRID_CELL_SIZE` pixel cells), and the rest of the previous
+# results are reused. The messages are the same as from a full check.
+GRID_CELL_SIZE = 64
+# Boxes spanning more grid cells than this are checked with a full check instead.
+MAX_GRID_CELLS_PER_BOX = 4096
+
+
+def check_state_path(fields_json_path: str) -> str:
+    directory, name = os.path.split(fields_json_path)
+    return os.path.join(directory, f".{name}.check_state.json")
+
+
+# What the checks depend on for one field: its page, label box, entry box and font size
+# (None if it has no `entry_text`).
+def _field_geometry(field):
+    font_size = field["entry_text"].get("font_size", 14) if "entry_text" in field else None
+    return [field["page_number"], field["label_bounding_box"], field["entry_bounding_box"], font_size]
+
+
+def _grid_cells(rect):
+    left, top, right, bottom = (int(v // GRID_CELL_SIZE) for v in rect)
+    if not (left <= right and top <= bottom):
+        # The grid can't index inverted boxes.
+        raise ValueError("inverted bounding box")
+    if (right - left + 1) * (bottom - top + 1) > MAX_GRID_CELLS_PER_BOX:
+        raise ValueError("bounding box too large for the grid")
+    return [(x, y) for x in range(left, right + 1) for y in range(top, bottom + 1)]
+
+
+# Returns (intersecting_pairs, short_entries) for `geometry` (from `_field_geometry`) by
+# updating the results in `state` from a previous check, or None if that isn't possible.
+def _update_check_results(geometry, state):
+    previous = state.get("geometry")
+    if previous is None or len(previous) != len(geometry):
+        return None
+    changed = [k for k, g in enumerate(geometry) if g != previous[k]]
+    changed_rects = {i for k in changed for i in (2 * k, 2 * k + 1)}
+    changed_pages = {geometry[k][0] for k in changed}
+
+    def rect(i):
+        return geometry[i // 2][1 + i % 2]
+
+    # Index every box on the pages with changed fields.
+    grid = {}
+    for k, (page, label_box, entry_box, _) in enumerate(geometry):
+        if page in changed_pages:
+            for i, box in ((2 * k, label_box), (2 * k + 1, entry_box)):
+                for cell in _grid_cells(box):
+                    grid.setdefault((page, cell), []).append(i)
+
+    pairs = {(i, j) for i, j in state["intersecting_pairs"] if i not in changed_rects and j not in changed_rects}
+    for i in changed_rects:
+        page = geometry[i // 2][0]
+        for cell in _grid_cells(rect(i)):
+            for j in grid.get((page, cell), ()):
+                lo, hi = min(i, j), max(i, j)
+                if i != j and (lo, hi) not in pairs and rects_intersect(rect(lo), rect(hi)):
+                    pairs.add((lo, hi))
+
+    short_entries = {i for i in state["short_entries"] if i not in changed_rects}
+    for k in changed:
+        font_size = geometry[k][3]
+        entry_box = geometry[k][2]
+        if font_size is not None and entry_box[3] - entry_box[1] < font_size:
+            short_entries.add(2 * k + 1)
+    return sorted(pairs), sorted(short_entries)
+
+
+def _write_check_state(state_path, state):
+    tmp_path = f"{state_path}.{os.getpid()}.tmp"
+    try:
+        # json.dumps uses the C encoder, unlike json.dump writing to a file.
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(state))
+        os.replace(tmp_path, state_path)
+    except OSError:
+        # The state only speeds up the next run.
+        pass
+
+
+# Same messages as `get_bounding_box_messages` for the `fields.json` file at
+# `fields_json_path`, reusing the results of the previous run on the same file where its
+# fields haven't changed (see `check_state_path`). Falls back to a full check the first
+# time, when fields are added or removed, or for boxes that the grid can't index.
+def get_bounding_box_messages_incremental(fields_json_path: str) -> list[str]:
+    with pdf_profile.phase("parse"), open(fields_json_path) as f:
+        form_fields = json.load(f)["form_fields"]
+    state_path = check_state_path(fields_json_path)
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+
+    with pdf_profile.phase("validate"):
+        geometry = [_field_geometry(f) for f in form_fields]
+        try:
+            results = _update_check_results(geometry, state)
+        except (TypeError, ValueError, KeyError):
+            results = None
+        if results is None:
+            rects_and_fields = [_rect_and_field(form_fields, i) for i in range(2 * len(form_fields))]
+            intersections = find_intersections(rects_and_fields)
+            intersecting_pairs = [(i, j) for i in sorted(intersections) for j in intersections[i]]
+            short_entries = [i for i in range(1, len(rects_and_fields), 2) if _entry_too_short(rects_and_fields[i])]
+        else:
+            intersecting_pairs, short_entries = results
+        messages = _build_messages(form_fields, intersecting_pairs, short_entries)
+
+    _write_check_state(state_path, {
+        "geometry": geometry,
+        "intersecting_pairs": intersecting_pairs,
+        "short_entries": short_entries,
+    })
     return messages
 
+
+# Contiguous arrays for all bounding boxes in a `fields.json` file, used by the vectorized
+# checks. `rects` has one [left, top, right, bottom] row per rect, interleaved as in
+# `_rect_and_field`; `pages` holds a page code per rect and `font_sizes` the font size per
+# field (NaN for fields without `entry_text`).
+@dataclass
+class BoundingBoxArrays:
+    rects: "np.ndarray"
+    pages: "np.ndarray"
+    font_sizes: "np.ndarray"
+
+
+def load_bounding_box_arrays(form_fields) -> BoundingBoxArrays:
+    page_codes = {}
+    rects = np.empty((2 * len(form_fields), 4), dtype=np.float64)
+    pages = np.empty(2 * len(form_fields), dtype=np.int64)
+    font_sizes = np.full(len(form_fields), np.nan)
+    for k, f in enumerate(form_fields):
+        rects[2 * k] = f["label_bounding_box"]
+        rects[2 * k + 1] = f["entry_bounding_box"]
+        pages[2 * k] = pages[2 * k + 1] = page_codes.setdefault(f["page_number"], len(page_codes))
+        if "entry_text" in f:
+            font_sizes[k] = f["entry_text"].get("font_size", 14)
+    return BoundingBoxArrays(rects, pages, font_sizes)
+
+
+# Vectorized equivalent of `find_intersections`. Returns (lo, hi) arrays of rect indices
+# with lo < hi for every intersecting pair, sorted by lo and then hi.
+def find_intersections_vectorized(arrays: BoundingBoxArrays):
+    rects = arrays.rects
+    order = np.lexsort((rects[:, 1], arrays.pages))
+    page_starts = np.flatnonzero(np.diff(arrays.pages[order])) + 1
+    lo_parts, hi_parts = [], []
+    for group in np.split(order, page_starts):
+        # Within a page sorted by top, the rects that can overlap a rect vertically are the
+        # following ones whose top is above its bottom, which is a contiguous run.
+        tops = rects[group, 1]
+        ends = np.searchsorted(tops, rects[group, 3], side="left")
+        counts = np.maximum(ends - np.arange(len(group)) - 1, 0)
+        first = np.repeat(np.arange(len(group)), counts)
+        run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+        second = first + 1 + (np.arange(len(first)) - run_starts)
+        lo = np.minimum(group[first], group[second])
+        hi = np.maximum(group[first], group[second])
+        r1, r2 = rects[lo], rects[hi]
+        disjoint_horizontal = (r1[:, 0] >= r2[:, 2]) | (r1[:, 2] <= r2[:, 0])
+        disjoint_vertical = (r1[:, 1] >= r2[:, 3]) | (r1[:, 3] <= r2[:, 1])
+        hit = ~(disjoint_horizontal | disjoint_vertical)
+        lo_parts.append(lo[hit])
+        hi_parts.append(hi[hit])
+    lo = np.concatenate(lo_parts) if lo_parts else np.empty(0, dtype=np.int64)
+    hi = np.concatenate(hi_parts) if hi_parts else np.empty(0, dtype=np.int64)
+    pair_order = np.lexsort((hi, lo))
+    return lo[pair_order], hi[pair_order]
+
+
+def _messages_for_fields_vectorized(form_fields) -> list[str]:
+    try:
+        arrays = load_bounding_box_arrays(form_fields)
+    except (TypeError, ValueError):
+        # Non-numeric boxes or font sizes; let the object-based check handle them as before.
+        return _messages_for_fields(form_fields)
+    lo, hi = find_intersections_vectorized(arrays)
+    entry_heights = arrays.rects[1::2, 3] - arrays.rects[1::2, 1]
+    short_entries = 2 * np.flatnonzero(entry_heights < arrays.font_sizes) + 1
+    # Only the first 19 failures can be reported, so only that many of each kind are needed.
+    intersecting_pairs = zip(lo[:19].tolist(), hi[:19].tolist())
+    return _build_messages(form_fields, intersecting_pairs, short_entries[:19].tolist())
+
+
+# Checks many `fields.json` files, yielding (path, messages) for each with the same messages
+# as `get_bounding_box_messages`. The intersection and height checks run as array operations
+# when NumPy is installed; otherwise this falls back to the object-based checks.
+def get_bounding_box_messages_batch(fields_json_paths):
+    for path in fields_json_paths:
+        with pdf_profile.phase("parse", path=path), open(path) as f:
+            form_fields = json.load(f)["form_fields"]
+        with pdf_profile.phase("validate", path=path):
+            if np is None:
+                messages = _messages_for_fields(form_fields)
+            else:
+                messages = _messages_for_fields_vectorized(form_fields)
+        yield path, messages
+
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: check_bounding_boxes.py [fields.json]")
+    pdf_profile.enable_from_argv(sys.argv)
+    if len(sys.argv) < 2:
+        print("Usage: check_bounding_boxes.py [--profile] [fields.json] [more fields.json files...]")
+        print("   or: check_bounding_boxes.py --incremental [fields.json]")
         sys.exit(1)
-    # Input file should be in the `fields.json` format described in forms.md.
-    with open(sys.argv[1]) as f:
-        messages = get_bounding_box_messages(f)
-    for msg in messages:
-        print(msg)
+    # Input files should be in the `fields.json` format described in forms.md.
+    if len(sys.argv) == 3 and sys.argv[1] == "--incremental":
+        for msg in get_bounding_box_messages_incremental(sys.argv[2]):
+            print(msg)
+    elif len(sys.argv) == 2:
+        with open(sys.argv[1]) as f:
+            messages = get_bounding_box_messages(f)
+        for msg in messages:
+            print(msg)
+    else:
+        for path, messages in get_bounding_box_messages_batch(sys.argv[1:]):
+            print(f"== {path}")
+            for msg in messages:
+                print(msg)
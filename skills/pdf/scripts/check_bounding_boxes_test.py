@@ -1,7 +1,35 @@
 import unittest
 import json
 import io
-from check_bounding_boxes import get_bounding_box_messages
+import os
+import random
+import tempfile
+from check_bounding_boxes import (
+    get_bounding_box_messages,
+    get_bounding_box_messages_batch,
+    get_bounding_box_messages_incremental,
+    rects_intersect,
+)
+
+
+def random_fields_data(rng, max_fields=12):
+    """Helper to create `fields.json` data with randomly placed, often overlapping boxes"""
+    def random_box():
+        left, top = rng.randint(0, 400), rng.randint(0, 400)
+        return [left, top, left + rng.randint(0, 60), top + rng.randint(0, 30)]
+
+    fields = []
+    for i in range(rng.randint(0, max_fields)):
+        field = {
+            "description": f"Field{i}",
+            "page_number": rng.randint(1, 2),
+            "label_bounding_box": random_box(),
+            "entry_bounding_box": random_box(),
+        }
+        if rng.random() < 0.5:
+            field["entry_text"] = {"font_size": rng.randint(5, 20)}
+        fields.append(field)
+    return {"form_fields": fields}
 
 
 # Currently this is not run automatically in CI; it's just for documentation and manual checking.
@@ -220,7 +248,83 @@ class TestGetBoundingBoxMessages(unittest.TestCase):
         messages = get_bounding_box_messages(stream)
         self.assertTrue(any("SUCCESS" in msg for msg in messages))
         self.assertFalse(any("FAILURE" in msg for msg in messages))
-    
+
+    def test_matches_pairwise_comparison(self):
+        """Test that the indexed check reports the same messages, in the same order, as comparing every pair"""
+        def pairwise_messages(data):
+            # Reference implementation: the original O(N^2) comparison of all rects.
+            messages = [f"Read {len(data['form_fields'])} fields"]
+            rects = []
+            for f in data["form_fields"]:
+                rects.append((f["label_bounding_box"], "label", f))
+                rects.append((f["entry_bounding_box"], "entry", f))
+            for i, (rect_i, type_i, field_i) in enumerate(rects):
+                for rect_j, type_j, field_j in rects[i + 1:]:
+                    if field_i["page_number"] == field_j["page_number"] and rects_intersect(rect_i, rect_j):
+                        if field_i is field_j:
+                            messages.append(f"FAILURE: intersection between label and entry bounding boxes for `{field_i['description']}` ({rect_i}, {rect_j})")
+                        else:
+                            messages.append(f"FAILURE: intersection between {type_i} bounding box for `{field_i['description']}` ({rect_i}) and {type_j} bounding box for `{field_j['description']}` ({rect_j})")
+                        if len(messages) >= 20:
+                            return messages + ["Aborting further checks; fix bounding boxes and try again"]
+                if type_i == "entry" and "entry_text" in field_i:
+                    font_size = field_i["entry_text"].get("font_size", 14)
+                    if rect_i[3] - rect_i[1] < font_size:
+                        messages.append(f"FAILURE: entry bounding box height ({rect_i[3] - rect_i[1]}) for `{field_i['description']}` is too short for the text content (font size: {font_size}). Increase the box height or decrease the font size.")
+                        if len(messages) >= 20:
+                            return messages + ["Aborting further checks; fix bounding boxes and try again"]
+            if len(messages) == 1:
+                messages.append("SUCCESS: All bounding boxes are valid")
+            return messages
+
+        rng = random.Random(1234)
+        for _ in range(200):
+            data = random_fields_data(rng)
+            messages = get_bounding_box_messages(self.create_json_stream(data))
+            self.assertEqual(messages, pairwise_messages(data))
+
+    def test_batch_matches_single_file(self):
+        """Test that batch checking reports the same messages as checking each file separately"""
+        rng = random.Random(5678)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            expected = {}
+            for i in range(100):
+                data = random_fields_data(rng, max_fields=30)
+                path = os.path.join(tmp_dir, f"fields_{i}.json")
+                with open(path, "w") as f:
+                    json.dump(data, f)
+                expected[path] = get_bounding_box_messages(self.create_json_stream(data))
+
+            results = dict(get_bounding_box_messages_batch(expected.keys()))
+        self.assertEqual(results, expected)
+
+    def test_incremental_matches_full_check(self):
+        """Test that incremental checks after moving, resizing and re-paging a few fields report the same messages as a full check"""
+        rng = random.Random(9012)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "fields.json")
+            for _ in range(20):
+                data = random_fields_data(rng, max_fields=40)
+                for _ in range(10):
+                    with open(path, "w") as f:
+                        json.dump(data, f)
+                    expected = get_bounding_box_messages(self.create_json_stream(data))
+                    self.assertEqual(get_bounding_box_messages_incremental(path), expected)
+
+                    for field in rng.sample(data["form_fields"], min(2, len(data["form_fields"]))):
+                        change = rng.choice(["move", "resize", "page", "font"])
+                        box = field[rng.choice(["label_bounding_box", "entry_bounding_box"])]
+                        if change == "move":
+                            dx, dy = rng.randint(-50, 50), rng.randint(-50, 50)
+                            box[:] = [box[0] + dx, box[1] + dy, box[2] + dx, box[3] + dy]
+                        elif change == "resize":
+                            box[2] = box[0] + rng.randint(0, 60)
+                            box[3] = box[1] + rng.randint(0, 30)
+                        elif change == "page":
+                            field["page_number"] = 3 - field["page_number"]
+                        else:
+                            field["entry_text"] = {"font_size": rng.randint(5, 20)}
+
 
 if __name__ == '__main__':
     unittest.main()
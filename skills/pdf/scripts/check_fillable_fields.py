@@ -1,12 +1,79 @@
+import json
 import sys
+from concurrent.futures import ProcessPoolExecutor
+
 from pypdf import PdfReader
 
+import pdf_profile
+
 
 # Script for Claude to run to determine whether a PDF has fillable form fields. See forms.md.
 
 
-reader = PdfReader(sys.argv[1])
-if (reader.get_fields()):
-    print("This PDF has fillable form fields")
-else:
-    print("This PDF does not have fillable form fields; you will need to visually determine where to enter data")
+# Returns True if the PDF has at least one terminal form field: a field without kids, or
+# whose kids are only widget annotations. Rather than resolving the whole field tree like
+# `reader.get_fields()`, this walks the catalog's /AcroForm /Fields array and stops at the
+# first terminal field. The file is read through an open handle so pypdf only parses the
+# objects that are visited.
+def has_fillable_fields(pdf_path: str) -> bool:
+    with open(pdf_path, "rb") as f:
+        reader = PdfReader(f)
+        acro_form = reader.trailer["/Root"].get("/AcroForm")
+        if acro_form is None:
+            return False
+        fields = acro_form.get_object().get("/Fields")
+        if fields is None:
+            return False
+        stack = list(reversed(fields.get_object()))
+        seen = set()
+        while stack:
+            ref = stack.pop()
+            key = (ref.idnum, ref.generation) if hasattr(ref, "idnum") else id(ref)
+            if key in seen:
+                continue
+            seen.add(key)
+            field = ref.get_object()
+            if not hasattr(field, "get"):
+                continue
+            kids = field.get("/Kids")
+            kids = kids.get_object() if kids is not None else None
+            # Kids without a /T are the field's widgets rather than child fields.
+            child_fields = [kid for kid in kids or [] if "/T" in kid.get_object()]
+            if not child_fields:
+                return True
+            stack.extend(reversed(child_fields))
+        return False
+
+
+def _check_path(pdf_path: str):
+    try:
+        with pdf_profile.phase("validate", path=pdf_path):
+            fillable = has_fillable_fields(pdf_path)
+        return {"path": pdf_path, "fillable": fillable}
+    except Exception as e:
+        return {"path": pdf_path, "error": f"{type(e).__name__}: {e}"}
+
+
+# Checks many PDFs in a process pool, writing a JSON line per path as
+# {"path": ..., "fillable": true/false} or {"path": ..., "error": ...}, in input order.
+def check_fillable_fields_bulk(pdf_paths, max_workers=None, report=sys.stdout):
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for result in executor.map(_check_path, pdf_paths, chunksize=32):
+            report.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    pdf_profile.enable_from_argv(sys.argv)
+    if len(sys.argv) < 2:
+        print("Usage: check_fillable_fields.py [--profile] [input pdf]")
+        print("   or: check_fillable_fields.py [input pdf] [input pdf] ... (prints a JSON line per PDF)")
+        sys.exit(1)
+    if len(sys.argv) > 2:
+        check_fillable_fields_bulk(sys.argv[1:])
+        sys.exit(0)
+    with pdf_profile.phase("validate", path=sys.argv[1]):
+        fillable = has_fillable_fields(sys.argv[1])
+    if fillable:
+        print("This PDF has fillable form fields")
+    else:
+        print("This PDF does not have fillable form fields; you will need to visually determine where to enter data")
@@ -1,35 +1,357 @@
+import argparse
+import hashlib
+import json
+import math
 import os
-import sys
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 from pdf2image import convert_from_path
+from PIL import Image
+from pypdf import PdfReader
 
+import pdf_profile
+from page_image_formats import DEFAULT_PNG_COMPRESS_LEVEL, IMAGE_FORMATS, save_image
 
-# Converts each page of a PDF to a PNG image.
 
+# Converts each page of a PDF to a PNG (or WebP or PPM) image.
 
-def convert(pdf_path, output_dir, max_dim=1000):
-    images = convert_from_path(pdf_path, dpi=200)
 
-    for i, image in enumerate(images):
-        # Scale image if needed to keep width/height under `max_dim`
-        width, height = image.size
-        if width > max_dim or height > max_dim:
-            scale_factor = min(max_dim / width, max_dim / height)
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-            image = image.resize((new_width, new_height))
-        
-        image_path = os.path.join(output_dir, f"page_{i+1}.png")
-        image.save(image_path)
-        print(f"Saved page {i+1} as {image_path} (size: {image.size})")
+# Pages are never rendered at more than this resolution, so pages that are small enough
+# come out at the same size they always have.
+MAX_DPI = 200
 
-    print(f"Converted {len(images)} pages to PNG images")
+
+# Returns the dpi at which a page of the given size (in points) renders with its longer side
+# at or just above `max_dim` pixels, so that little more than the kept pixels are rasterized.
+# With `fast`, rounds down instead so the page fits within `max_dim` without a resampling pass.
+def target_dpi(page_width, page_height, max_dim, fast=False):
+    exact_dpi = max_dim * 72 / max(page_width, page_height)
+    dpi = math.floor(exact_dpi) if fast else math.ceil(exact_dpi)
+    return max(1, min(MAX_DPI, dpi))
+
+
+# Returns the render dpi for each page. pdftoppm renders the media box (convert_from_path
+# doesn't pass `-cropbox`), so that's the size the dpi is computed from.
+def page_dpis(pdf_path, max_dim, fast=False):
+    with pdf_profile.phase("parse"):
+        reader = PdfReader(pdf_path)
+        return [
+            target_dpi(float(page.mediabox.width), float(page.mediabox.height), max_dim, fast)
+            for page in reader.pages
+        ]
+
+
+# Returns the size in pixels pdftoppm renders `page` at `dpi`: the media box scaled and
+# rounded up, with width and height swapped for pages rotated by 90 or 270 degrees.
+def rendered_size(page, dpi):
+    width = math.ceil(float(page.mediabox.width) * (dpi / 72.0))
+    height = math.ceil(float(page.mediabox.height) * (dpi / 72.0))
+    if page.rotation % 180 == 90:
+        width, height = height, width
+    return width, height
+
+
+# Returns the size `save_page_image` scales an image of the given size to.
+def scaled_size(width, height, max_dim):
+    if width > max_dim or height > max_dim:
+        scale_factor = min(max_dim / width, max_dim / height)
+        return int(width * scale_factor), int(height * scale_factor)
+    return width, height
+
+
+# Returns the size of the image `convert` writes for `page`, without rendering it.
+def page_image_size(page, max_dim=1000, fast=False):
+    dpi = target_dpi(float(page.mediabox.width), float(page.mediabox.height), max_dim, fast)
+    return scaled_size(*rendered_size(page, dpi), max_dim)
+
+
+# Groups consecutive pages that render at the same dpi into (first_page, last_page, dpi)
+# runs (1-based, inclusive), optionally splitting runs so none is longer than `max_pages`.
+# `pages` is an iterable of (page_number, dpi) in increasing page order.
+def dpi_runs(pages, max_pages=None):
+    runs = []
+    for page_number, dpi in pages:
+        if (runs and runs[-1][1] == page_number - 1 and runs[-1][2] == dpi
+                and (max_pages is None or page_number - runs[-1][0] < max_pages)):
+            runs[-1] = (runs[-1][0], page_number, dpi)
+        else:
+            runs.append((page_number, page_number, dpi))
+    return runs
+
+
+# Scales and saves one page image as `page_N.<image_format>`; returns the saved path and the
+# final image size.
+def save_page_image(image, output_dir, page_number, max_dim, fast=False, image_format="png",
+                    compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
+    # Scale image if needed to keep width/height under `max_dim`
+    width, height = image.size
+    if width > max_dim or height > max_dim:
+        new_width, new_height = scaled_size(width, height, max_dim)
+        with pdf_profile.phase("resize", page=page_number):
+            if fast:
+                image = image.resize((new_width, new_height), Image.NEAREST)
+            else:
+                image = image.resize((new_width, new_height))
+
+    image_path = os.path.join(output_dir, f"page_{page_number}.{image_format}")
+    # Replace rather than overwrite an existing image, which may be hard linked into the
+    # page cache.
+    if os.path.exists(image_path):
+        os.remove(image_path)
+    with pdf_profile.phase("write", page=page_number):
+        save_image(image, image_path, compress_level)
+    return image_path, image.size
+
+
+def link_or_copy(src, dest):
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+# On-disk cache of converted page images, keyed by the PDF's content hash, the page index,
+# the render dpi, `max_dim` and the image format. Cached images are hard linked (or copied, across
+# filesystems) into the output directory. Entries are evicted least recently used first
+# once the cache grows past `max_bytes`; a hit refreshes an entry's mtime.
+class PageImageCache:
+    def __init__(self, cache_dir, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    # Returns the SHA-256 of the PDF's contents. The hash is remembered per path, size and
+    # mtime so that unchanged documents aren't re-read on every run.
+    def document_hash(self, pdf_path):
+        st = os.stat(pdf_path)
+        stat_key = f"{os.path.realpath(pdf_path)}:{st.st_size}:{st.st_mtime_ns}"
+        stat_path = os.path.join(self.cache_dir, "stat_" + hashlib.sha256(stat_key.encode()).hexdigest())
+        try:
+            with open(stat_path) as f:
+                pdf_hash = f.read()
+            os.utime(stat_path)
+            return pdf_hash
+        except FileNotFoundError:
+            pass
+        digest = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        self._write_atomic(stat_path, digest.hexdigest())
+        return digest.hexdigest()
+
+    def _write_atomic(self, path, text):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def _dpis_path(self, pdf_hash, max_dim, fast):
+        return os.path.join(self.cache_dir, f"dpis_mediabox_{pdf_hash}_m{max_dim}{'_fast' if fast else ''}.json")
+
+    def _page_path(self, pdf_hash, page_index, dpi, max_dim, fast, image_format):
+        return os.path.join(self.cache_dir, f"page_{pdf_hash}_p{page_index}_d{dpi}_m{max_dim}{'_fast' if fast else ''}.{image_format}")
+
+    # Returns the cached per-page dpis for the document, or None.
+    def get_dpis(self, pdf_hash, max_dim, fast):
+        path = self._dpis_path(pdf_hash, max_dim, fast)
+        try:
+            with open(path) as f:
+                dpis = json.load(f)
+            os.utime(path)
+            return dpis
+        except FileNotFoundError:
+            return None
+
+    def put_dpis(self, pdf_hash, max_dim, fast, dpis):
+        self._write_atomic(self._dpis_path(pdf_hash, max_dim, fast), json.dumps(dpis))
+
+    # Links the cached image for a page to `dest` and returns True, or returns False if the
+    # page isn't cached.
+    def get_page(self, pdf_hash, page_index, dpi, max_dim, fast, image_format, dest):
+        path = self._page_path(pdf_hash, page_index, dpi, max_dim, fast, image_format)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        link_or_copy(path, dest)
+        return True
+
+    def put_page(self, pdf_hash, page_index, dpi, max_dim, fast, image_format, src):
+        path = self._page_path(pdf_hash, page_index, dpi, max_dim, fast, image_format)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        link_or_copy(src, tmp_path)
+        os.replace(tmp_path, path)
+
+    # Removes least recently used entries until the cache is within `max_bytes`.
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+# Returns the render dpi for each page and a list of (page_number, dpi) for the pages that
+# still need rendering; pages found in `cache` are linked into `output_dir` and reported.
+def prepare_pages(pdf_path, output_dir, max_dim, fast, cache, image_format="png"):
+    if cache is None:
+        dpis = page_dpis(pdf_path, max_dim, fast)
+        return dpis, list(enumerate(dpis, start=1))
+
+    pdf_hash = cache.document_hash(pdf_path)
+    dpis = cache.get_dpis(pdf_hash, max_dim, fast)
+    if dpis is None:
+        dpis = page_dpis(pdf_path, max_dim, fast)
+        cache.put_dpis(pdf_hash, max_dim, fast, dpis)
+
+    pending = []
+    for page_number, dpi in enumerate(dpis, start=1):
+        image_path = os.path.join(output_dir, f"page_{page_number}.{image_format}")
+        if cache.get_page(pdf_hash, page_number - 1, dpi, max_dim, fast, image_format, image_path):
+            with Image.open(image_path) as image:
+                print(f"Saved page {page_number} as {image_path} (size: {image.size}, cached)")
+        else:
+            pending.append((page_number, dpi))
+    return dpis, pending
+
+
+# Adds newly rendered pages to `cache` and trims it to its size limit.
+def cache_rendered_pages(pdf_path, max_dim, fast, cache, rendered, image_format="png"):
+    if cache is None:
+        return
+    pdf_hash = cache.document_hash(pdf_path)
+    for page_number, dpi, image_path in rendered:
+        cache.put_page(pdf_hash, page_number - 1, dpi, max_dim, fast, image_format, image_path)
+    cache.evict()
+
+
+# Renders each page at the dpi that gets it closest to `max_dim` rather than rendering at a
+# fixed dpi and shrinking it afterwards. `fast` trades quality for speed for thumbnail-style
+# previews. With a `PageImageCache`, pages already converted from identical PDF contents are
+# reused instead of rendered. `image_format` is one of `IMAGE_FORMATS`.
+# With `encode_threads`, pages are rasterized `encode_threads` at a time and each batch is
+# scaled and encoded in a thread pool while the next one is rasterized (pdftoppm runs in a
+# subprocess and Pillow releases the GIL while encoding).
+def convert(pdf_path, output_dir, max_dim=1000, fast=False, cache=None, image_format="png",
+            compress_level=DEFAULT_PNG_COMPRESS_LEVEL, encode_threads=0):
+    dpis, pending = prepare_pages(pdf_path, output_dir, max_dim, fast, cache, image_format)
+    rendered = []
+
+    def saved(page_number, dpi, image_path, size):
+        print(f"Saved page {page_number} as {image_path} (size: {size})")
+        rendered.append((page_number, dpi, image_path))
+
+    with ThreadPoolExecutor(max_workers=max(1, encode_threads)) as encoder:
+        queued = deque()
+        for first_page, last_page, dpi in dpi_runs(pending, max_pages=encode_threads or None):
+            with pdf_profile.phase("rasterize", first_page=first_page, last_page=last_page, dpi=dpi):
+                images = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page)
+            for page_number, image in enumerate(images, start=first_page):
+                if encode_threads:
+                    future = encoder.submit(save_page_image, image, output_dir, page_number, max_dim, fast,
+                                            image_format, compress_level)
+                    queued.append((page_number, dpi, future))
+                else:
+                    saved(page_number, dpi, *save_page_image(image, output_dir, page_number, max_dim, fast,
+                                                             image_format, compress_level))
+            # Wait for the previous batch, so at most two batches of pages are held in memory.
+            while len(queued) > encode_threads:
+                page_number, dpi, future = queued.popleft()
+                saved(page_number, dpi, *future.result())
+        while queued:
+            page_number, dpi, future = queued.popleft()
+            saved(page_number, dpi, *future.result())
+    cache_rendered_pages(pdf_path, max_dim, fast, cache, rendered, image_format)
+
+    print(f"Converted {len(dpis)} pages to {image_format.upper()} images")
+
+
+# Rasterizes pages `first_page` through `last_page` (1-based, inclusive) and saves them.
+# Runs in a worker process; each page is released as soon as it has been saved, so only
+# one chunk of rendered pages is held in memory at a time.
+def convert_chunk(pdf_path, output_dir, max_dim, first_page, last_page, dpi, fast=False, image_format="png",
+                  compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
+    with pdf_profile.phase("rasterize", first_page=first_page, last_page=last_page, dpi=dpi):
+        images = convert_from_path(pdf_path, dpi=dpi, first_page=first_page, last_page=last_page)
+    images.reverse()
+    saved = []
+    page_number = first_page
+    while images:
+        image = images.pop()
+        image_path, size = save_page_image(image, output_dir, page_number, max_dim, fast, image_format, compress_level)
+        image.close()
+        saved.append((page_number, image_path, size))
+        page_number += 1
+    return saved
+
+
+# Like `convert`, but rasterizes `chunk_size` pages at a time and spreads the chunks over a
+# process pool. Peak memory depends on the chunk size and number of workers rather than on
+# the length of the document.
+def convert_streaming(pdf_path, output_dir, max_dim=1000, chunk_size=8, max_workers=None, fast=False, cache=None,
+                      image_format="png", compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
+    dpis, pending = prepare_pages(pdf_path, output_dir, max_dim, fast, cache, image_format)
+    chunks = dpi_runs(pending, max_pages=chunk_size)
+
+    rendered = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            (dpi, executor.submit(convert_chunk, pdf_path, output_dir, max_dim, first_page, last_page, dpi, fast,
+                                  image_format, compress_level))
+            for first_page, last_page, dpi in chunks
+        ]
+        for dpi, future in futures:
+            for page_number, image_path, size in future.result():
+                print(f"Saved page {page_number} as {image_path} (size: {size})")
+                rendered.append((page_number, dpi, image_path))
+    cache_rendered_pages(pdf_path, max_dim, fast, cache, rendered, image_format)
+
+    print(f"Converted {len(dpis)} pages to {image_format.upper()} images")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: convert_pdf_to_images.py [input pdf] [output directory]")
-        sys.exit(1)
-    pdf_path = sys.argv[1]
-    output_directory = sys.argv[2]
-    convert(pdf_path, output_directory)
+    parser = argparse.ArgumentParser(description="Converts each page of a PDF to a PNG (or WebP or PPM) image.")
+    parser.add_argument("pdf_path", help="input pdf")
+    parser.add_argument("output_dir", help="output directory")
+    parser.add_argument("--max-dim", type=int, default=1000, help="maximum width/height of each image in pixels")
+    parser.add_argument("--fast", action="store_true",
+                        help="faster, lower quality rendering for thumbnail previews")
+    parser.add_argument("--stream", action="store_true",
+                        help="rasterize in page chunks across worker processes to bound memory use on long documents")
+    parser.add_argument("--chunk-size", type=int, default=8, help="pages per chunk in --stream mode")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes in --stream mode")
+    parser.add_argument("--cache-dir", help="reuse page images from previous conversions of the same PDF contents")
+    parser.add_argument("--cache-max-mb", type=int, default=1024, help="size limit of the page image cache")
+    parser.add_argument("--format", choices=IMAGE_FORMATS, default="png", help="image format (all are lossless)")
+    parser.add_argument("--compress-level", type=int, default=DEFAULT_PNG_COMPRESS_LEVEL, choices=range(10),
+                        metavar="0-9", help="PNG compression level; higher is smaller and slower")
+    parser.add_argument("--encode-threads", type=int, default=0,
+                        help="encode pages in this many threads while the next pages are rasterized")
+    parser.add_argument("--profile", action="store_true",
+                        help="write per-phase timings as JSON lines to stderr (see pdf_profile.py)")
+    args = parser.parse_args()
+    if args.profile:
+        pdf_profile.enable()
+    cache = PageImageCache(args.cache_dir, args.cache_max_mb * 1024 * 1024) if args.cache_dir else None
+    if args.stream:
+        convert_streaming(args.pdf_path, args.output_dir, args.max_dim, chunk_size=args.chunk_size,
+                          max_workers=args.workers, fast=args.fast, cache=cache,
+                          image_format=args.format, compress_level=args.compress_level)
+    else:
+        convert(args.pdf_path, args.output_dir, args.max_dim, fast=args.fast, cache=cache,
+                image_format=args.format, compress_level=args.compress_level, encode_threads=args.encode_threads)
@@ -1,41 +1,233 @@
+import hashlib
 import json
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 from PIL import Image, ImageDraw
 
+import pdf_profile
+from page_image_formats import IMAGE_FORMATS, save_image
+
 
 # Creates "validation" images with rectangles for the bounding box information that
 # Claude creates when determining where to add text annotations in PDFs. See forms.md.
 
 
-def create_validation_image(page_number, fields_json_path, input_path, output_path):
+# Draws the boxes for `fields` onto the image at `input_path`, saves it to `output_path`
+# and returns the number of boxes drawn.
+def draw_field_boxes(fields, input_path, output_path):
+    with pdf_profile.phase("parse", image=input_path):
+        img = Image.open(input_path)
+        img.load()
+
+    with pdf_profile.phase("draw", image=input_path):
+        draw = ImageDraw.Draw(img)
+        num_boxes = 0
+
+        for field in fields:
+            entry_box = field['entry_bounding_box']
+            label_box = field['label_bounding_box']
+            # Draw red rectangle over entry bounding box and blue rectangle over the label.
+            draw.rectangle(entry_box, outline='red', width=2)
+            draw.rectangle(label_box, outline='blue', width=2)
+            num_boxes += 2
+
+    with pdf_profile.phase("write", image=output_path):
+        save_image(img, output_path)
+    return num_boxes
+
+
+# Pixels of the page kept around each field's boxes in a contact sheet.
+CROP_PADDING = 20
+# Maximum width of a contact sheet; crops are placed left to right in rows up to this width.
+CONTACT_SHEET_WIDTH = 1200
+CAPTION_HEIGHT = 14
+# Maximum width/height of an overview image.
+OVERVIEW_MAX_DIM = 600
+
+
+# Like `draw_field_boxes`, but instead of re-encoding the whole page, writes a contact sheet
+# of crops around each field's boxes (with `CROP_PADDING` pixels of the page around them),
+# each outlined and captioned with the field's label. Large page images are much faster to review and to
+# write this way.
+def draw_field_crop_sheet(fields, input_path, output_path):
+    with pdf_profile.phase("parse", image=input_path):
+        img = Image.open(input_path)
+        img.load()
+
+    with pdf_profile.phase("draw", image=input_path):
+        crops = []
+        for field in fields:
+            entry_box = field['entry_bounding_box']
+            label_box = field['label_bounding_box']
+            left = max(0, int(min(entry_box[0], label_box[0])) - CROP_PADDING)
+            top = max(0, int(min(entry_box[1], label_box[1])) - CROP_PADDING)
+            right = min(img.width, int(max(entry_box[2], label_box[2])) + CROP_PADDING + 1)
+            bottom = min(img.height, int(max(entry_box[3], label_box[3])) + CROP_PADDING + 1)
+            crop = img.crop((left, top, max(right, left + 1), max(bottom, top + 1))).convert("RGB")
+            draw = ImageDraw.Draw(crop)
+            draw.rectangle([entry_box[0] - left, entry_box[1] - top, entry_box[2] - left, entry_box[3] - top], outline='red', width=2)
+            draw.rectangle([label_box[0] - left, label_box[1] - top, label_box[2] - left, label_box[3] - top], outline='blue', width=2)
+            if crop.width > CONTACT_SHEET_WIDTH:
+                crop = crop.resize((CONTACT_SHEET_WIDTH, max(1, crop.height * CONTACT_SHEET_WIDTH // crop.width)))
+            crops.append((str(field.get('field_label') or field.get('description') or ''), crop))
+
+        # Place the crops in rows, each with its caption above it.
+        sheet_width = max(1, min(CONTACT_SHEET_WIDTH, sum(crop.width + CROP_PADDING for _, crop in crops) - CROP_PADDING))
+        positions = []
+        x = y = row_height = 0
+        for _, crop in crops:
+            if x > 0 and x + crop.width > sheet_width:
+                x, y, row_height = 0, y + row_height + CROP_PADDING, 0
+            positions.append((x, y))
+            x += crop.width + CROP_PADDING
+            row_height = max(row_height, CAPTION_HEIGHT + crop.height)
+        sheet = Image.new("RGB", (sheet_width, max(1, y + row_height)), "white")
+        draw = ImageDraw.Draw(sheet)
+        for (caption, crop), (x, y) in zip(crops, positions):
+            draw.text((x, y), caption, fill='black')
+            sheet.paste(crop, (x, y + CAPTION_HEIGHT))
+            draw.rectangle([x, y + CAPTION_HEIGHT, x + crop.width - 1, y + CAPTION_HEIGHT + crop.height - 1], outline='gray')
+
+    with pdf_profile.phase("write", image=output_path):
+        save_image(sheet, output_path)
+    return 2 * len(fields)
+
+
+# Like `draw_field_boxes`, but writes the page shrunk by an integer factor to fit within
+# `OVERVIEW_MAX_DIM`, with the boxes drawn at the reduced scale.
+def draw_field_overview(fields, input_path, output_path):
+    with pdf_profile.phase("parse", image=input_path):
+        img = Image.open(input_path)
+        img.load()
+
+    with pdf_profile.phase("resize", image=input_path):
+        factor = max(1, -(-max(img.size) // OVERVIEW_MAX_DIM))
+        img = img.reduce(factor).convert("RGB")
+
+    with pdf_profile.phase("draw", image=input_path):
+        draw = ImageDraw.Draw(img)
+        for field in fields:
+            draw.rectangle([v / factor for v in field['entry_bounding_box']], outline='red', width=1)
+            draw.rectangle([v / factor for v in field['label_bounding_box']], outline='blue', width=1)
+
+    with pdf_profile.phase("write", image=output_path):
+        save_image(img, output_path)
+    return 2 * len(fields)
+
+
+# Drawing function for each output mode: the full page, a contact sheet of field crops, or
+# a downscaled overview of the page.
+DRAW_FUNCTIONS = {
+    "full": draw_field_boxes,
+    "crops": draw_field_crop_sheet,
+    "overview": draw_field_overview,
+}
+
+
+def create_validation_image(page_number, fields_json_path, input_path, output_path, mode="full"):
     # Input file should be in the `fields.json` format described in forms.md.
     with open(fields_json_path, 'r') as f:
         data = json.load(f)
 
-        img = Image.open(input_path)
-        draw = ImageDraw.Draw(img)
-        num_boxes = 0
-        
-        for field in data["form_fields"]:
-            if field["page_number"] == page_number:
-                entry_box = field['entry_bounding_box']
-                label_box = field['label_bounding_box']
-                # Draw red rectangle over entry bounding box and blue rectangle over the label.
-                draw.rectangle(entry_box, outline='red', width=2)
-                draw.rectangle(label_box, outline='blue', width=2)
-                num_boxes += 2
-        
-        img.save(output_path)
-        print(f"Created validation image at {output_path} with {num_boxes} bounding boxes")
+    fields = [field for field in data["form_fields"] if field["page_number"] == page_number]
+    num_boxes = DRAW_FUNCTIONS[mode](fields, input_path, output_path)
+    print(f"Created validation image at {output_path} with {num_boxes} bounding boxes")
+
+
+# Returns a dict mapping page number to that page's fields. Pages listed in the `pages`
+# section without any fields are included with no fields.
+def group_fields_by_page(data):
+    fields_by_page = {page["page_number"]: [] for page in data.get("pages", [])}
+    for field in data["form_fields"]:
+        fields_by_page.setdefault(field["page_number"], []).append(field)
+    return fields_by_page
+
+
+# Creates validation images for every page in one pass: `fields.json` is parsed once and
+# the pages are drawn in a process pool. Reads `page_N.<image_format>` from `input_dir` (as
+# written by convert_pdf_to_images.py) and writes `page_N_validation.<image_format>` to
+# `output_dir`.
+# With `incremental`, pages whose fields, page image and drawing mode are the same as when
+# their validation image was last drawn are skipped; what each page was drawn from is kept
+# in a hidden `.validation_state.json` file in `output_dir`.
+def create_validation_images(fields_json_path, input_dir, output_dir, max_workers=None, mode="full", image_format="png",
+                             incremental=False):
+    with open(fields_json_path, 'r') as f:
+        data = json.load(f)
+    fields_by_page = group_fields_by_page(data)
+
+    state_path = os.path.join(output_dir, ".validation_state.json")
+    state = {}
+    if incremental:
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    unchanged = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for page_number, fields in sorted(fields_by_page.items()):
+            input_path = os.path.join(input_dir, f"page_{page_number}.{image_format}")
+            output_path = os.path.join(output_dir, f"page_{page_number}_validation.{image_format}")
+            if incremental:
+                signature = page_signature(fields, input_path, mode)
+                if state.get(str(page_number)) == signature and os.path.exists(output_path):
+                    unchanged += 1
+                    continue
+                state[str(page_number)] = signature
+            futures[output_path] = executor.submit(DRAW_FUNCTIONS[mode], fields, input_path, output_path)
+        for output_path, future in futures.items():
+            print(f"Created validation image at {output_path} with {future.result()} bounding boxes")
+
+    if incremental:
+        with open(state_path, "w") as f:
+            json.dump(state, f)
+        print(f"Created {len(futures)} validation images, {unchanged} unchanged")
+    else:
+        print(f"Created {len(futures)} validation images")
+
+
+# Identifies what a page's validation image is drawn from: its fields, the page image (by
+# size and mtime) and the drawing mode.
+def page_signature(fields, input_path, mode):
+    try:
+        st = os.stat(input_path)
+        image_key = [st.st_size, st.st_mtime_ns]
+    except OSError:
+        image_key = None
+    key = json.dumps([fields, image_key, mode], sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 5:
-        print("Usage: create_validation_image.py [page number] [fields.json file] [input image path] [output image path]")
+    pdf_profile.enable_from_argv(sys.argv)
+    mode = "full"
+    for flag in ("--crops", "--overview"):
+        if flag in sys.argv:
+            sys.argv.remove(flag)
+            mode = flag[2:]
+    incremental = "--incremental" in sys.argv
+    if incremental:
+        sys.argv.remove("--incremental")
+    image_format = "png"
+    if "--format" in sys.argv[:-1]:
+        i = sys.argv.index("--format")
+        image_format = sys.argv.pop(i + 1)
+        sys.argv.pop(i)
+    if len(sys.argv) != 5 or image_format not in IMAGE_FORMATS:
+        print("Usage: create_validation_image.py [--profile] [--crops | --overview] [page number] [fields.json file] [input image path] [output image path]")
+        print("   or: create_validation_image.py --all [--incremental] [--format png|webp|ppm] [fields.json file] [input image directory] [output directory]")
         sys.exit(1)
-    page_number = int(sys.argv[1])
-    fields_json_path = sys.argv[2]
-    input_image_path = sys.argv[3]
-    output_image_path = sys.argv[4]
-    create_validation_image(page_number, fields_json_path, input_image_path, output_image_path)
+    if sys.argv[1] == "--all":
+        create_validation_images(sys.argv[2], sys.argv[3], sys.argv[4], mode=mode, image_format=image_format,
+                                 incremental=incremental)
+    else:
+        page_number = int(sys.argv[1])
+        fields_json_path = sys.argv[2]
+        input_image_path = sys.argv[3]
+        output_image_path = sys.argv[4]
+        create_validation_image(page_number, fields_json_path, input_image_path, output_image_path, mode=mode)
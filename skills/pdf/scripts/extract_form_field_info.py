@@ -1,7 +1,21 @@
+import contextlib
+import glob
+import hashlib
+import io
 import json
+import os
+import signal
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 
+import pypdf
 from pypdf import PdfReader
+from pypdf.generic import IndirectObject
+
+import pdf_profile
+from pdf_input import enable_mmap_from_argv, open_pdf_reader
 
 
 # Extracts data for the fillable form fields in a PDF and outputs JSON that
@@ -19,14 +33,84 @@ def get_full_annotation_field_id(annotation):
     return ".".join(reversed(components)) if components else None
 
 
-def make_field_dict(field, field_id):
+def _indirect_key(obj):
+    ref = obj if isinstance(obj, IndirectObject) else getattr(obj, "indirect_reference", None)
+    return (ref.idnum, ref.generation) if ref is not None else None
+
+
+# Same result as `get_full_annotation_field_id`, but memoizes the full id of every field
+# dictionary on the way up the `/Parent` chain in `field_ids`, keyed on its indirect object
+# number and generation. Widgets that share ancestors then only resolve each ancestor once.
+def get_cached_field_id(annotation, field_ids):
+    chain = []
+    field_id = None
+    node = annotation
+    while node:
+        key = _indirect_key(node)
+        if key is not None and key in field_ids:
+            field_id = field_ids[key]
+            break
+        chain.append((key, node))
+        node = node.get('/Parent')
+    for key, node in reversed(chain):
+        field_name = node.get('/T')
+        if field_name:
+            field_id = f"{field_id}.{field_name}" if field_id else str(field_name)
+        if key is not None:
+            field_ids[key] = field_id
+    return field_id
+
+
+# Yields (field_id, field, widgets) for every terminal field in the form's `/Fields` tree,
+# without reading the pages. `widgets` are the field's kids that have no /T of their own (the
+# widgets of a radio group), or the field itself when it is its own widget. Field IDs are
+# built the same way as by `get_full_annotation_field_id`.
+def iter_terminal_fields(acro_form):
+    fields = acro_form.get("/Fields")
+    stack = [(ref, None) for ref in reversed(fields.get_object())] if fields is not None else []
+    seen = set()
+    while stack:
+        ref, parent_id = stack.pop()
+        key = _indirect_key(ref)
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        field = ref.get_object()
+        if not hasattr(field, "get"):
+            continue
+        field_name = field.get('/T')
+        field_id = (f"{parent_id}.{field_name}" if parent_id else str(field_name)) if field_name else parent_id
+        kids = field.get("/Kids")
+        kids = [kid.get_object() for kid in kids.get_object()] if kids is not None else []
+        child_fields = [kid for kid in kids if "/T" in kid]
+        if child_fields:
+            stack.extend((kid.indirect_reference or kid, field_id) for kid in reversed(child_fields))
+        else:
+            yield field_id, field, kids or [field]
+
+
+# Returns (page_number, field_id, annotation) for every annotation in the document, in
+# page order, from a single traversal of the pages.
+def get_annotation_records(reader: PdfReader):
+    field_ids = {}
+    records = []
+    for page_index, page in enumerate(reader.pages):
+        for ann in page.get('/Annots', []):
+            records.append((page_index + 1, get_cached_field_id(ann, field_ids), ann))
+    return records
+
+
+# `states` defaults to the "/_States_" that pypdf's `get_fields` adds to each field.
+def make_field_dict(field, field_id, states=None):
+    if states is None:
+        states = field.get("/_States_", [])
     field_dict = {"field_id": field_id}
     ft = field.get('/FT')
     if ft == "/Tx":
         field_dict["type"] = "text"
     elif ft == "/Btn":
         field_dict["type"] = "checkbox"  # radio groups handled separately
-        states = field.get("/_States_", [])
         if len(states) == 2:
             # "/Off" seems to always be the unchecked value, as suggested by
             # https://opensource.adobe.com/dc-acrobat-sdk-docs/standards/pdfstandards/pdf/PDF32000_2008.pdf#page=448
@@ -40,7 +124,6 @@ def make_field_dict(field, field_id):
                 field_dict["unchecked_value"] = states[1]
     elif ft == "/Ch":
         field_dict["type"] = "choice"
-        states = field.get("/_States_", [])
         field_dict["choice_options"] = [{
             "value": state[0],
             "text": state[1],
@@ -81,37 +164,34 @@ def get_field_info(reader: PdfReader):
     # See https://westhealth.github.io/exploring-fillable-forms-with-pdfrw.html
     radio_fields_by_id = {}
 
-    for page_index, page in enumerate(reader.pages):
-        annotations = page.get('/Annots', [])
-        for ann in annotations:
-            field_id = get_full_annotation_field_id(ann)
-            if field_id in field_info_by_id:
-                field_info_by_id[field_id]["page"] = page_index + 1
-                field_info_by_id[field_id]["rect"] = ann.get('/Rect')
-            elif field_id in possible_radio_names:
-                try:
-                    # ann['/AP']['/N'] should have two items. One of them is '/Off',
-                    # the other is the active value.
-                    on_values = [v for v in ann["/AP"]["/N"] if v != "/Off"]
-                except KeyError:
-                    continue
-                if len(on_values) == 1:
-                    rect = ann.get("/Rect")
-                    if field_id not in radio_fields_by_id:
-                        radio_fields_by_id[field_id] = {
-                            "field_id": field_id,
-                            "type": "radio_group",
-                            "page": page_index + 1,
-                            "radio_options": [],
-                        }
-                    # Note: at least on macOS 15.7, Preview.app doesn't show selected
-                    # radio buttons correctly. (It does if you remove the leading slash
-                    # from the value, but that causes them not to appear correctly in
-                    # Chrome/Firefox/Acrobat/etc).
-                    radio_fields_by_id[field_id]["radio_options"].append({
-                        "value": on_values[0],
-                        "rect": rect,
-                    })
+    for page_number, field_id, ann in get_annotation_records(reader):
+        if field_id in field_info_by_id:
+            field_info_by_id[field_id]["page"] = page_number
+            field_info_by_id[field_id]["rect"] = ann.get('/Rect')
+        elif field_id in possible_radio_names:
+            try:
+                # ann['/AP']['/N'] should have two items. One of them is '/Off',
+                # the other is the active value.
+                on_values = [v for v in ann["/AP"]["/N"] if v != "/Off"]
+            except KeyError:
+                continue
+            if len(on_values) == 1:
+                rect = ann.get("/Rect")
+                if field_id not in radio_fields_by_id:
+                    radio_fields_by_id[field_id] = {
+                        "field_id": field_id,
+                        "type": "radio_group",
+                        "page": page_number,
+                        "radio_options": [],
+                    }
+                # Note: at least on macOS 15.7, Preview.app doesn't show selected
+                # radio buttons correctly. (It does if you remove the leading slash
+                # from the value, but that causes them not to appear correctly in
+                # Chrome/Firefox/Acrobat/etc).
+                radio_fields_by_id[field_id]["radio_options"].append({
+                    "value": on_values[0],
+                    "rect": rect,
+                })
 
     # Some PDFs have form field definitions without corresponding annotations,
     # so we can't tell where they are. Ignore these fields for now.
@@ -137,16 +217,404 @@ def get_field_info(reader: PdfReader):
     return sorted_fields
 
 
+# The states pypdf's `get_fields` records for a field: a choice field's /Opt entries, or the
+# names of a button's normal appearances plus "/Off".
+def _field_states(field):
+    ft = field.get("/FT")
+    if ft == "/Ch" and field.get("/Opt"):
+        return field["/Opt"]
+    if ft == "/Btn" and "/AP" in field:
+        states = list(field["/AP"]["/N"].keys())
+        if "/Off" not in states:
+            states.append("/Off")
+        return states
+    return []
+
+
+# Returns the 1-based number of a page dictionary by walking up the page tree from it and
+# counting the pages before it at each level, so only its ancestors and their direct kids are
+# read. Returns None if the page isn't reachable from `pages_key`, the root /Pages node.
+def _page_number(page, pages_key):
+    number = 1
+    node = page
+    seen = set()
+    while "/Parent" in node:
+        key = _indirect_key(node)
+        if key is None or key in seen:
+            return None
+        seen.add(key)
+        parent = node["/Parent"]
+        for kid in parent.get("/Kids", []):
+            if _indirect_key(kid) == key:
+                break
+            kid = kid.get_object()
+            number += kid.get("/Count", 1) if kid.get("/Type") == "/Pages" else 1
+        else:
+            return None
+        node = parent
+    return number if _indirect_key(node) == pages_key else None
+
+
+# Same entries as `get_field_info` returns for the fields in `field_ids`, without reading every
+# page: the fields are found through the form's /Fields tree and each widget's page through
+# its /P entry. Fields that don't exist or aren't fillable are left out, as they are by
+# `get_field_info`. Returns None if a widget of a requested field has no usable /P, in which
+# case only the full pass can tell where it is.
+def get_field_info_for_ids(reader: PdfReader, field_ids):
+    root = reader.trailer["/Root"]
+    if "/AcroForm" not in root:
+        return []
+    pages_key = _indirect_key(root.raw_get("/Pages"))
+    wanted = set(field_ids)
+    field_info = []
+    for field_id, field, widgets in iter_terminal_fields(root["/AcroForm"]):
+        if field_id not in wanted:
+            continue
+        wanted.discard(field_id)
+        located = []
+        for widget in widgets:
+            page = widget.get("/P")
+            page_number = _page_number(page.get_object(), pages_key) if page is not None else None
+            if page_number is None:
+                return None
+            located.append((page_number, widget))
+
+        if not field.get("/Kids"):
+            field_dict = make_field_dict(field, field_id, _field_states(field))
+            field_dict["page"] = located[0][0]
+            field_dict["rect"] = field.get("/Rect")
+            field_info.append(field_dict)
+        elif field.get("/FT") == "/Btn":
+            # A radio group; its options are collected as in `get_field_info`.
+            options = []
+            for page_number, widget in sorted(located, key=lambda item: item[0]):
+                try:
+                    on_values = [v for v in widget["/AP"]["/N"] if v != "/Off"]
+                except KeyError:
+                    continue
+                if len(on_values) == 1:
+                    options.append((page_number, {"value": on_values[0], "rect": widget.get("/Rect")}))
+            if options:
+                field_info.append({
+                    "field_id": field_id,
+                    "type": "radio_group",
+                    "page": options[0][0],
+                    "radio_options": [option for _, option in options],
+                })
+        if not wanted:
+            break
+    return field_info
+
+
+# The field info for a PDF can be cached, so that extract_form_field_info.py and
+# fill_fillable_fields.py don't both walk every page and annotation of the same template.
+# Caching is off unless a cache directory is given with `--cache-dir` or the
+# PDF_FIELD_INFO_CACHE environment variable (which worker processes inherit); nothing is
+# written next to the input PDFs. Entries are keyed on the PDF's path and validated against
+# its SHA-256 and the pypdf version; the file size and mtime are also recorded so an
+# unchanged file isn't re-hashed. The warnings `get_field_info` prints are stored with the
+# entry and printed again when it's used.
+FIELD_INFO_CACHE_ENV_VAR = "PDF_FIELD_INFO_CACHE"
+
+
+# Removes `--cache-dir DIR` from `argv` if present and turns the field info cache on.
+def enable_field_info_cache_from_argv(argv):
+    if "--cache-dir" in argv:
+        i = argv.index("--cache-dir")
+        if i + 1 >= len(argv):
+            raise SystemExit("--cache-dir needs a directory")
+        os.environ[FIELD_INFO_CACHE_ENV_VAR] = argv[i + 1]
+        del argv[i:i + 2]
+
+
+# Returns the cache file for `pdf_path`, or None when caching is off.
+def schema_cache_path(pdf_path: str):
+    cache_dir = os.environ.get(FIELD_INFO_CACHE_ENV_VAR)
+    if not cache_dir:
+        return None
+    path_hash = hashlib.sha256(os.path.realpath(pdf_path).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{path_hash}_{os.path.basename(pdf_path)}.field_info.json")
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_schema_cache(cache_path, stat, sha256, field_info, warnings):
+    cache = {
+        "sha256": sha256,
+        "pypdf_version": pypdf.__version__,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "field_info": field_info,
+        "warnings": warnings,
+    }
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # The cache is only an optimization; e.g. the cache directory may be read-only.
+        pass
+    finally:
+        if os.path.exists(tmp_path):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+# Same result and output as `get_field_info`, using the cache when it's enabled. `reader`
+# may be an already opened reader for `pdf_path`, used on a cache miss.
+def get_field_info_cached(pdf_path: str, reader: PdfReader = None):
+    cache_path = schema_cache_path(pdf_path)
+    cache = None
+    if cache_path:
+        stat = os.stat(pdf_path)
+        try:
+            with open(cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = None
+
+    sha256 = None
+    if cache and cache.get("pypdf_version") == pypdf.__version__ and "warnings" in cache:
+        hit = cache.get("size") == stat.st_size and cache.get("mtime_ns") == stat.st_mtime_ns
+        if not hit:
+            sha256 = file_sha256(pdf_path)
+            hit = cache.get("sha256") == sha256
+            if hit:
+                _write_schema_cache(cache_path, stat, sha256, cache["field_info"], cache["warnings"])
+        if hit:
+            for warning in cache["warnings"]:
+                print(warning)
+            return cache["field_info"]
+
+    if reader is None:
+        with pdf_profile.phase("parse"):
+            reader = open_pdf_reader(pdf_path)
+    output = io.StringIO()
+    with pdf_profile.phase("field_resolution"), contextlib.redirect_stdout(output):
+        field_info = get_field_info(reader)
+    warnings = output.getvalue().splitlines()
+    for warning in warnings:
+        print(warning)
+    if cache_path:
+        # Round-trip through JSON so the result is the same whether or not it came from the cache.
+        field_info = json.loads(json.dumps(field_info))
+        _write_schema_cache(cache_path, stat, sha256 or file_sha256(pdf_path), field_info, warnings)
+    return field_info
+
+
 def write_field_info(pdf_path: str, json_output_path: str):
-    reader = PdfReader(pdf_path)
-    field_info = get_field_info(reader)
-    with open(json_output_path, "w") as f:
+    field_info = get_field_info_cached(pdf_path)
+    with pdf_profile.phase("write"), open(json_output_path, "w") as f:
         json.dump(field_info, f, indent=2)
     print(f"Wrote {len(field_info)} fields to {json_output_path}")
 
 
+# Returns the PDFs under a directory (recursively), or the PDFs matching a glob pattern
+# (`**` matches subdirectories), in sorted order.
+def find_pdf_paths(directory_or_glob: str):
+    if os.path.isdir(directory_or_glob):
+        paths = []
+        for dirpath, _, filenames in os.walk(directory_or_glob):
+            paths.extend(os.path.join(dirpath, name) for name in filenames if name.lower().endswith(".pdf"))
+    else:
+        paths = [p for p in glob.glob(directory_or_glob, recursive=True) if os.path.isfile(p)]
+    return sorted(paths)
+
+
+# Returns the paths already recorded in a batch output file, so an interrupted batch can be
+# resumed. A line cut off by the interruption is ignored and its document is redone.
+def read_batch_checkpoint(jsonl_path: str):
+    done = set()
+    try:
+        with open(jsonl_path) as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["path"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return done
+
+
+# Raised by the SIGALRM handler. It isn't an `Exception`, so pypdf's recovery code (which
+# catches `Exception` in many places) can't swallow it.
+class _DocumentTimeout(BaseException):
+    pass
+
+
+def _raise_timeout(signum, frame):
+    raise _DocumentTimeout()
+
+
+def _batch_error_line(pdf_path: str, error: str):
+    return json.dumps({"path": pdf_path, "status": "error", "error": error})
+
+
+# Runs in a worker process and returns the document's status and JSONL line. pypdf parses in Python,
+# so a SIGALRM timer can interrupt a document that takes longer than `timeout` seconds
+# (on platforms without SIGALRM only the parent's deadline in `write_field_info_batch`
+# applies). The signal is only handled between Python bytecodes, so a worker stuck inside a
+# single C call (e.g. zlib inflating a huge stream) isn't interrupted; the parent kills it
+# instead. Batch mode doesn't use the field info cache, and the notes `get_field_info`
+# prints about skipped fields are dropped so they don't interleave with other workers' output.
+def _extract_for_batch(pdf_path: str, timeout):
+    use_alarm = timeout and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            with pdf_profile.phase("parse", path=pdf_path):
+                reader = open_pdf_reader(pdf_path)
+            with pdf_profile.phase("field_resolution", path=pdf_path):
+                fields = get_field_info(reader)
+        return "ok", json.dumps({"path": pdf_path, "status": "ok", "fields": fields})
+    except _DocumentTimeout:
+        return "error", _batch_error_line(pdf_path, f"timed out after {timeout}s")
+    except Exception as e:
+        return "error", _batch_error_line(pdf_path, f"{type(e).__name__}: {e}")
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+# How long past its timeout a document may run before the parent kills its worker.
+_KILL_GRACE_SECONDS = 10
+
+
+# Stops every worker of `executor` at once, including one stuck in a C call, which
+# `shutdown` would wait for forever. ProcessPoolExecutor has no public way to do this
+# before Python 3.14.
+def _kill_pool(executor):
+    for process in list((executor._processes or {}).values()):
+        process.kill()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Extracts the field info of every PDF matched by `directory_or_glob` in a process pool and
+# appends one JSON line per document to `jsonl_output_path` as results come in:
+#   {"path": ..., "status": "ok", "fields": [...]} or {"path": ..., "status": "error", "error": ...}
+# The output file doubles as the checkpoint: documents it already has a line for are
+# skipped, so rerunning the same command after an interruption picks up where it stopped.
+# Only as many documents as there are workers are submitted at a time, so each one starts
+# right away and the parent can hold it to a deadline: a document still running
+# `_KILL_GRACE_SECONDS` after its timeout (stuck where SIGALRM can't reach it) is recorded
+# as timed out, and the pool is killed and replaced. If a worker dies on its own, the
+# documents that were running with it are retried one at a time, so only the one that
+# crashes the worker again is recorded as failed. Documents cut off by a restart get no
+# line, so they aren't mistaken for done.
+def write_field_info_batch(directory_or_glob: str, jsonl_output_path: str, timeout=60, max_workers=None):
+    done = read_batch_checkpoint(jsonl_output_path)
+    pending = iter([p for p in find_pdf_paths(directory_or_glob) if p not in done])
+    counts = {"ok": 0, "error": 0}
+
+    with open(jsonl_output_path, "a+") as out:
+        # Start on a fresh line if the previous run was cut off mid-line.
+        if out.tell() > 0:
+            out.seek(out.tell() - 1)
+            if out.read(1) != "\n":
+                out.write("\n")
+
+        def record(status, line):
+            out.write(line + "\n")
+            counts[status] += 1
+
+        max_workers = max_workers or os.cpu_count() or 1
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+        in_flight = {}  # future -> (pdf path, deadline or None)
+        retry = []  # documents cut off by a pool restart, not responsible for it
+        suspects = []  # documents running when a worker died, to be retried one at a time
+
+        def submit_more():
+            while True:
+                if suspects:
+                    if in_flight:
+                        return
+                    pdf_path = suspects.pop(0)
+                elif len(in_flight) >= max_workers:
+                    return
+                elif retry:
+                    pdf_path = retry.pop(0)
+                else:
+                    pdf_path = next(pending, None)
+                    if pdf_path is None:
+                        return
+                deadline = time.monotonic() + timeout + _KILL_GRACE_SECONDS if timeout else None
+                in_flight[executor.submit(_extract_for_batch, pdf_path, timeout)] = (pdf_path, deadline)
+
+        try:
+            submit_more()
+            while in_flight:
+                deadlines = [deadline for _, deadline in in_flight.values() if deadline is not None]
+                wait_for = max(0, min(deadlines) - time.monotonic()) if deadlines else None
+                finished, _ = wait(in_flight, timeout=wait_for, return_when=FIRST_COMPLETED)
+                now = time.monotonic()
+                expired = [f for f, (_, deadline) in in_flight.items()
+                           if f not in finished and deadline is not None and deadline <= now]
+                if expired:
+                    for future in expired:
+                        pdf_path, _ = in_flight.pop(future)
+                        record("error", _batch_error_line(pdf_path, f"timed out after {timeout}s (worker killed)"))
+                    _kill_pool(executor)
+                    finished, _ = wait(in_flight)
+                    executor = ProcessPoolExecutor(max_workers=max_workers)
+                    lost = retry
+                elif any(isinstance(f.exception(), BrokenProcessPool) for f in finished):
+                    # A worker died (e.g. killed by the OS, or crashed in C code) and took the
+                    # pool down with it. With only one document running, that document is the
+                    # cause; otherwise there's no telling which one was.
+                    crashed_alone = len(in_flight) == 1
+                    finished, _ = wait(in_flight)
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(max_workers=max_workers)
+                    lost = None if crashed_alone else suspects
+                else:
+                    lost = None
+                for future in finished:
+                    pdf_path, _ = in_flight.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        record(*future.result())
+                    elif isinstance(error, BrokenProcessPool) and lost is not None:
+                        lost.append(pdf_path)
+                    elif isinstance(error, BrokenProcessPool):
+                        record("error", _batch_error_line(pdf_path, f"worker process died: {error}"))
+                    elif isinstance(error, _DocumentTimeout):
+                        record("error", _batch_error_line(pdf_path, f"timed out after {timeout}s"))
+                    else:
+                        record("error", _batch_error_line(pdf_path, f"{type(error).__name__}: {error}"))
+                out.flush()
+                submit_more()
+        except BaseException:
+            _kill_pool(executor)
+            raise
+        executor.shutdown()
+
+    print(f"Extracted fields from {counts['ok']} PDFs, {counts['error']} failed, {len(done)} already done")
+    return counts
+
+
 if __name__ == "__main__":
+    pdf_profile.enable_from_argv(sys.argv)
+    enable_mmap_from_argv(sys.argv)
+    enable_field_info_cache_from_argv(sys.argv)
+    if len(sys.argv) in (4, 5) and sys.argv[1] == "--batch":
+        timeout = float(sys.argv[4]) if len(sys.argv) == 5 else 60
+        counts = write_field_info_batch(sys.argv[2], sys.argv[3], timeout=timeout)
+        sys.exit(1 if counts["error"] else 0)
     if len(sys.argv) != 3:
-        print("Usage: extract_form_field_info.py [input pdf] [output json]")
+        print("Usage: extract_form_field_info.py [--profile] [--mmap] [--cache-dir dir] [input pdf] [output json]")
+        print("   or: extract_form_field_info.py --batch [pdf directory or glob] [output jsonl] [timeout seconds, default 60]")
         sys.exit(1)
     write_field_info(sys.argv[1], sys.argv[2])
@@ -1,15 +1,27 @@
+import contextlib
+import csv
 import json
+import os
 import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
 from pypdf import PdfReader, PdfWriter
+from pypdf.generic import BooleanObject, NameObject, TextStringObject
 
-from extract_form_field_info import get_field_info
+import pdf_profile
+from pdf_input import check_output_is_not_input, enable_mmap_from_argv, open_pdf_reader
+from extract_form_field_info import (
+    enable_field_info_cache_from_argv, get_field_info_cached, get_field_info_for_ids, iter_terminal_fields,
+)
+from pdf_incremental_update import write_incremental_update
 
 
 # Fills fillable form fields in a PDF. See forms.md.
 
 
-def fill_pdf_fields(input_pdf_path: str, fields_json_path: str, output_pdf_path: str):
+# A `reader` already opened on the input PDF can be passed in to avoid parsing it again; it
+# isn't modified. It isn't used in lazy mode.
+def fill_pdf_fields(input_pdf_path: str, fields_json_path: str, output_pdf_path: str, lazy: bool = False, reader: PdfReader = None):
     with open(fields_json_path) as f:
         fields = json.load(f)
     # Group by page number.
@@ -22,28 +34,56 @@ def fill_pdf_fields(input_pdf_path: str, fields_json_path: str, output_pdf_path:
                 fields_by_page[page] = {}
             fields_by_page[page][field_id] = field["value"]
     
-    reader = PdfReader(input_pdf_path)
+    # In lazy mode the document is read from the file as needed, and the fields being filled
+    # are validated against field info for just those fields, so the pages that don't hold
+    # them aren't read. The full field info is only built if a field's page can't be found
+    # that way.
+    if lazy:
+        with pdf_profile.phase("parse"):
+            reader = open_pdf_reader(input_pdf_path, from_file=True)
+        with pdf_profile.phase("field_resolution"):
+            field_info = get_field_info_for_ids(reader, [field["field_id"] for field in fields])
+        if field_info is None:
+            field_info = get_field_info_cached(input_pdf_path, reader)
+    else:
+        check_output_is_not_input(input_pdf_path, output_pdf_path)
+        if reader is None:
+            with pdf_profile.phase("parse"):
+                reader = open_pdf_reader(input_pdf_path)
+        field_info = get_field_info_cached(input_pdf_path, reader)
 
     has_error = False
-    field_info = get_field_info(reader)
-    fields_by_ids = {f["field_id"]: f for f in field_info}
-    for field in fields:
-        existing_field = fields_by_ids.get(field["field_id"])
-        if not existing_field:
-            has_error = True
-            print(f"ERROR: `{field['field_id']}` is not a valid field ID")
-        elif field["page"] != existing_field["page"]:
-            has_error = True
-            print(f"ERROR: Incorrect page number for `{field['field_id']}` (got {field['page']}, expected {existing_field['page']})")
-        else:
-            if "value" in field:
-                err = validation_error_for_field_value(existing_field, field["value"])
-                if err:
-                    print(err)
-                    has_error = True
+    with pdf_profile.phase("validate"):
+        validators = compile_field_validators(field_info)
+        for field in fields:
+            validator = validators.get(field["field_id"])
+            if not validator:
+                has_error = True
+                print(f"ERROR: `{field['field_id']}` is not a valid field ID")
+            elif field["page"] != validator.field_info["page"]:
+                has_error = True
+                print(f"ERROR: Incorrect page number for `{field['field_id']}` (got {field['page']}, expected {validator.field_info['page']})")
+            else:
+                if "value" in field:
+                    err = validator.error_for_value(field["value"])
+                    if err:
+                        print(err)
+                        has_error = True
     if has_error:
+        if lazy:
+            reader.stream.close()
         sys.exit(1)
 
+    with pdf_profile.phase("write"):
+        if lazy:
+            write_filled_pdf_lazily(reader, input_pdf_path, fields_by_page, validators, output_pdf_path)
+            reader.stream.close()
+        else:
+            write_filled_pdf(reader, fields_by_page, output_pdf_path)
+
+
+# `fields_by_page` maps 1-based page numbers to {field_id: value} dicts.
+def write_filled_pdf(reader: PdfReader, fields_by_page, output_pdf_path: str):
     writer = PdfWriter(clone_from=reader)
     for page, field_values in fields_by_page.items():
         writer.update_page_form_field_values(writer.pages[page - 1], field_values, auto_regenerate=False)
@@ -51,28 +91,237 @@ def fill_pdf_fields(input_pdf_path: str, fields_json_path: str, output_pdf_path:
     # This seems to be necessary for many PDF viewers to format the form values correctly.
     # It may cause the viewer to show a "save changes" dialog even if the user doesn't make any changes.
     writer.set_need_appearances_writer(True)
-    
+
     with open(output_pdf_path, "wb") as f:
         writer.write(f)
 
 
-def validation_error_for_field_value(field_info, field_value):
-    field_type = field_info["type"]
-    field_id = field_info["field_id"]
-    if field_type == "checkbox":
-        checked_val = field_info["checked_value"]
-        unchecked_val = field_info["unchecked_value"]
-        if field_value != checked_val and field_value != unchecked_val:
+# Fills fields by appending an incremental update to the original PDF instead of cloning the
+# whole document. `reader` should read from an open file (`open_pdf_reader` with `from_file`),
+# and the fields are found through the form's /Fields tree, so pypdf parses only the form
+# dictionary and the field and widget dictionaries on the way to the filled fields; the pages
+# aren't read. Only the field and widget dictionaries that change are written after the
+# original bytes, and `reader` shouldn't be reused afterwards.
+# Values are set directly (/V, plus /AS for checkbox and radio widgets). No appearance streams
+# are generated: the output relies on viewers honoring /NeedAppearances to render the values.
+# `validators` are from `compile_field_validators`.
+def write_filled_pdf_lazily(reader: PdfReader, input_pdf_path: str, fields_by_page, validators, output_pdf_path: str):
+    field_values = {field_id: value for values in fields_by_page.values() for field_id, value in values.items()}
+    updated_objects = {}
+
+    def mark_updated(obj):
+        ref = obj.indirect_reference
+        if ref is None:
+            raise ValueError("Can't update a direct object in an incremental update")
+        updated_objects[ref.idnum] = (ref.generation, obj)
+
+    root = reader.trailer["/Root"]
+    acro_form = root["/AcroForm"]
+    remaining = set(field_values)
+    for field_id, field, widgets in iter_terminal_fields(acro_form):
+        if field_id not in remaining:
+            continue
+        remaining.discard(field_id)
+        value = field_values[field_id]
+        if validators[field_id].field_info["type"] in ("checkbox", "radio_group"):
+            field[NameObject("/V")] = NameObject(value)
+            for widget in widgets:
+                try:
+                    states = widget["/AP"]["/N"]
+                except KeyError:
+                    states = {}
+                widget[NameObject("/AS")] = NameObject(value if value in states else "/Off")
+                mark_updated(widget)
+        else:
+            field[NameObject("/V")] = TextStringObject(value)
+        mark_updated(field)
+        if not remaining:
+            break
+
+    # See the comment on `set_need_appearances_writer` in `write_filled_pdf`.
+    acro_form[NameObject("/NeedAppearances")] = BooleanObject(True)
+    mark_updated(acro_form if acro_form.indirect_reference is not None else root)
+
+    write_incremental_update(reader, input_pdf_path, updated_objects, int(reader.trailer["/Size"]), output_pdf_path)
+
+
+# Yields (record, error) for each record in a JSONL file (one JSON object per line) or a CSV
+# file (a header row of field IDs; empty cells leave the field unset). `record` is a
+# {field_id: value} dict, or None with an error message if the line isn't a JSON object. The
+# optional "_output" key names the record's output PDF.
+def read_records(records_path: str):
+    with open(records_path, newline="") as f:
+        if records_path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield {k: v for k, v in row.items() if v}, None
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    yield None, f"ERROR: invalid JSON: {e}"
+                    continue
+                if isinstance(record, dict):
+                    yield record, None
+                else:
+                    yield None, f"ERROR: record is a JSON {type(record).__name__}, not an object"
+
+
+# Validates one bulk record against the template's fields, given the validators from
+# `compile_field_validators`. Returns (errors, fields_by_page).
+def validate_record(record, validators):
+    errors = []
+    fields_by_page = {}
+    for field_id, value in record.items():
+        if field_id == "_output":
+            continue
+        validator = validators.get(field_id)
+        if not validator:
+            errors.append(f"ERROR: `{field_id}` is not a valid field ID")
+            continue
+        err = validator.error_for_value(value)
+        if err:
+            errors.append(err)
+            continue
+        fields_by_page.setdefault(validator.field_info["page"], {})[field_id] = value
+    return errors, fields_by_page
+
+
+# The template is parsed once per worker process and reused for every record.
+_bulk_template_reader = None
+
+
+def _init_bulk_worker(template_pdf_path: str):
+    global _bulk_template_reader
+    monkeypatch_pydpf_method()
+    with pdf_profile.phase("parse"):
+        _bulk_template_reader = open_pdf_reader(template_pdf_path)
+
+
+def _fill_bulk_record(job):
+    index, output_pdf_path, fields_by_page = job
+    try:
+        with pdf_profile.phase("write", record=index):
+            write_filled_pdf(_bulk_template_reader, fields_by_page, output_pdf_path)
+        return index, output_pdf_path, None
+    except Exception as e:
+        return index, output_pdf_path, f"ERROR: {e}"
+
+
+# Fills `template_pdf_path` once per record in `records_path` (see `read_records`), writing
+# one PDF per record to `output_dir`. The template's fields are read and each record is
+# validated in this process; valid records are filled in a process pool. A JSON line is
+# written to `report` for each record as its result comes in. Records are read and queued a
+# bounded number at a time, so the first results are reported right away and memory use
+# doesn't grow with the number of records. Records that can't be parsed, or whose output
+# name is already used by an earlier record, are reported as errors. Warnings about the
+# template's fields go to stderr, so they don't mix with the report when it's on stdout.
+def fill_pdf_fields_bulk(template_pdf_path: str, records_path: str, output_dir: str, max_workers=None, report=sys.stdout):
+    with contextlib.redirect_stdout(sys.stderr):
+        validators = compile_field_validators(get_field_info_cached(template_pdf_path))
+    counts = {"ok": 0, "error": 0}
+
+    def report_result(index, output_pdf_path, errors):
+        status = "error" if errors else "ok"
+        counts[status] += 1
+        report.write(json.dumps({"record": index, "output": output_pdf_path, "status": status, "errors": errors}) + "\n")
+        report.flush()
+
+    def jobs():
+        output_owners = {}
+        for index, (record, error) in enumerate(read_records(records_path), start=1):
+            if error:
+                report_result(index, None, [error])
+                continue
+            output_name = os.path.basename(str(record.get("_output") or f"record_{index}.pdf"))
+            output_pdf_path = os.path.join(output_dir, output_name)
+            if output_name in output_owners:
+                report_result(index, output_pdf_path, [f"ERROR: output `{output_name}` is already used by record {output_owners[output_name]}"])
+                continue
+            try:
+                check_output_is_not_input(template_pdf_path, output_pdf_path)
+            except ValueError as e:
+                report_result(index, output_pdf_path, [f"ERROR: {e}"])
+                continue
+            output_owners[output_name] = index
+            with pdf_profile.phase("validate", record=index):
+                errors, fields_by_page = validate_record(record, validators)
+            if errors:
+                report_result(index, output_pdf_path, errors)
+            else:
+                yield index, output_pdf_path, fields_by_page
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_bulk_worker, initargs=(template_pdf_path,)) as executor:
+        pending = jobs()
+        max_queued = 4 * (max_workers or os.cpu_count() or 1)
+        in_flight = set()
+
+        def submit_more():
+            for job in pending:
+                in_flight.add(executor.submit(_fill_bulk_record, job))
+                if len(in_flight) >= max_queued:
+                    break
+
+        submit_more()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight.remove(future)
+                index, output_pdf_path, error = future.result()
+                report_result(index, output_pdf_path, [error] if error else [])
+            submit_more()
+
+    print(f"Filled {counts['ok']} records, {counts['error']} failed", file=sys.stderr)
+    return counts
+
+
+# A precompiled check for values of one field from `get_field_info`. The valid checkbox,
+# radio and choice values are held in a frozenset, so checking a value is a hash lookup
+# rather than a scan of the options. Build these once with `compile_field_validators` and
+# reuse them for any number of value files.
+class FieldValidator:
+    def __init__(self, field_info):
+        self.field_info = field_info
+        field_type = field_info["type"]
+        if field_type == "checkbox":
+            self.valid_values = [field_info.get("checked_value"), field_info.get("unchecked_value")]
+        elif field_type == "radio_group":
+            self.valid_values = [opt["value"] for opt in field_info["radio_options"]]
+        elif field_type == "choice":
+            self.valid_values = [opt["value"] for opt in field_info["choice_options"]]
+        else:
+            self.valid_values = None
+        self.valid_value_set = frozenset(self.valid_values) if self.valid_values is not None else None
+
+    def error_for_value(self, field_value):
+        if self.valid_value_set is None:
+            return None
+        try:
+            if field_value in self.valid_value_set:
+                return None
+        except TypeError:
+            # Unhashable values such as lists can't be valid options.
+            pass
+        field_type = self.field_info["type"]
+        field_id = self.field_info["field_id"]
+        if field_type == "checkbox":
+            checked_val, unchecked_val = self.valid_values
             return f'ERROR: Invalid value "{field_value}" for checkbox field "{field_id}". The checked value is "{checked_val}" and the unchecked value is "{unchecked_val}"'
-    elif field_type == "radio_group":
-        option_values = [opt["value"] for opt in field_info["radio_options"]]
-        if field_value not in option_values:
-            return f'ERROR: Invalid value "{field_value}" for radio group field "{field_id}". Valid values are: {option_values}' 
-    elif field_type == "choice":
-        choice_values = [opt["value"] for opt in field_info["choice_options"]]
-        if field_value not in choice_values:
-            return f'ERROR: Invalid value "{field_value}" for choice field "{field_id}". Valid values are: {choice_values}'
-    return None
+        elif field_type == "radio_group":
+            return f'ERROR: Invalid value "{field_value}" for radio group field "{field_id}". Valid values are: {self.valid_values}' 
+        else:
+            return f'ERROR: Invalid value "{field_value}" for choice field "{field_id}". Valid values are: {self.valid_values}'
+
+
+# Returns a dict mapping field ID to a `FieldValidator` for each field from `get_field_info`.
+def compile_field_validators(field_info):
+    return {f["field_id"]: FieldValidator(f) for f in field_info}
+
+
+def validation_error_for_field_value(field_info, field_value):
+    return FieldValidator(field_info).error_for_value(field_value)
 
 
 # pypdf (at least version 5.7.0) has a bug when setting the value for a selection list field.
@@ -92,6 +341,9 @@ def monkeypatch_pydpf_method():
     from pypdf.constants import FieldDictionaryAttributes
 
     original_get_inherited = DictionaryObject.get_inherited
+    # Bulk worker processes patch on startup, which may already have been done in the parent.
+    if getattr(original_get_inherited, "_is_patched", False):
+        return
 
     def patched_get_inherited(self, key: str, default = None):
         result = original_get_inherited(self, key, default)
@@ -100,15 +352,27 @@ def monkeypatch_pydpf_method():
                 result = [r[0] for r in result]
         return result
 
+    patched_get_inherited._is_patched = True
     DictionaryObject.get_inherited = patched_get_inherited
 
 
 if __name__ == "__main__":
+    pdf_profile.enable_from_argv(sys.argv)
+    enable_mmap_from_argv(sys.argv)
+    enable_field_info_cache_from_argv(sys.argv)
+    lazy = "--lazy" in sys.argv[1:]
+    if lazy:
+        sys.argv.remove("--lazy")
+    if len(sys.argv) == 5 and sys.argv[1] == "--bulk":
+        monkeypatch_pydpf_method()
+        counts = fill_pdf_fields_bulk(sys.argv[2], sys.argv[3], sys.argv[4])
+        sys.exit(1 if counts["error"] else 0)
     if len(sys.argv) != 4:
-        print("Usage: fill_fillable_fields.py [input pdf] [field_values.json] [output pdf]")
+        print("Usage: fill_fillable_fields.py [--lazy] [--profile] [--mmap] [--cache-dir dir] [input pdf] [field_values.json] [output pdf]")
+        print("   or: fill_fillable_fields.py --bulk [template pdf] [records.jsonl or records.csv] [output directory]")
         sys.exit(1)
     monkeypatch_pydpf_method()
     input_pdf = sys.argv[1]
     fields_json = sys.argv[2]
     output_pdf = sys.argv[3]
-    fill_pdf_fields(input_pdf, fields_json, output_pdf)
+    fill_pdf_fields(input_pdf, fields_json, output_pdf, lazy=lazy)
@@ -1,8 +1,18 @@
 import json
 import sys
 
-from pypdf import PdfReader, PdfWriter
+from pypdf import PdfWriter
 from pypdf.annotations import FreeText
+from pypdf.generic import ArrayObject, IndirectObject, NameObject
+
+import pdf_profile
+from pdf_input import check_output_is_not_input, enable_mmap_from_argv, open_pdf_reader
+from pdf_incremental_update import write_incremental_update
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 # Fills a PDF by adding text annotations defined in `fields.json`. See forms.md.
@@ -25,43 +35,100 @@ def transform_coordinates(bbox, image_width, image_height, pdf_width, pdf_height
     return left, bottom, right, top
 
 
-def fill_pdf_form(input_pdf_path, fields_json_path, output_pdf_path):
+def transform_page_boxes(bboxes, image_width, image_height, pdf_width, pdf_height):
+    """Transform all bounding boxes on one page from image coordinates to PDF coordinates"""
+    # Same transform as `transform_coordinates`, but the scale factors are computed once for
+    # the page, and the boxes are transformed as one array operation when NumPy is available.
+    x_scale = pdf_width / image_width
+    y_scale = pdf_height / image_height
+    if np is None:
+        return [
+            (bbox[0] * x_scale, pdf_height - (bbox[3] * y_scale), bbox[2] * x_scale, pdf_height - (bbox[1] * y_scale))
+            for bbox in bboxes
+        ]
+
+    boxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    transformed = np.empty_like(boxes)
+    transformed[:, 0] = boxes[:, 0] * float(x_scale)
+    transformed[:, 1] = float(pdf_height) - (boxes[:, 3] * float(y_scale))
+    transformed[:, 2] = boxes[:, 2] * float(x_scale)
+    transformed[:, 3] = float(pdf_height) - (boxes[:, 1] * float(y_scale))
+    return [tuple(box) for box in transformed.tolist()]
+
+
+def add_annotations_incrementally(reader, input_pdf_path, page_annotations, output_pdf_path):
+    """Add annotations to a PDF by appending an incremental update to the original bytes"""
+    # Only the new annotation objects and the page dictionaries that reference them are
+    # written, so the work scales with the number of annotations rather than the size of
+    # the document.
+    next_id = int(reader.trailer["/Size"])
+    updated_objects = {}  # object number -> (generation, object)
+    for page_num, annotation in page_annotations:
+        page = reader.pages[page_num - 1]
+        page_ref = page.indirect_reference
+        if page_ref.idnum not in updated_objects:
+            existing_annots = page.get("/Annots")
+            existing_annots = existing_annots.get_object() if existing_annots is not None else []
+            page[NameObject("/Annots")] = ArrayObject(existing_annots)
+            updated_objects[page_ref.idnum] = (page_ref.generation, page)
+        annotation[NameObject("/P")] = page_ref
+        page["/Annots"].append(IndirectObject(next_id, 0, reader))
+        updated_objects[next_id] = (0, annotation)
+        next_id += 1
+
+    write_incremental_update(reader, input_pdf_path, updated_objects, next_id, output_pdf_path)
+
+
+def fill_pdf_form(input_pdf_path, fields_json_path, output_pdf_path, incremental=False, reader=None):
     """Fill the PDF form with data from fields.json"""
+    # `reader` may be an already opened reader for the input PDF. In incremental mode its page
+    # dictionaries are modified, so it shouldn't be reused afterwards.
     
     # `fields.json` format described in forms.md.
     with open(fields_json_path, "r") as f:
         fields_data = json.load(f)
     
+    if not incremental:
+        check_output_is_not_input(input_pdf_path, output_pdf_path)
+
     # Open the PDF
-    reader = PdfReader(input_pdf_path)
-    writer = PdfWriter()
-    
-    # Copy all pages to writer
-    writer.append(reader)
-    
-    # Get PDF dimensions for each page
-    pdf_dimensions = {}
-    for i, page in enumerate(reader.pages):
-        mediabox = page.mediabox
-        pdf_dimensions[i + 1] = [mediabox.width, mediabox.height]
+    with pdf_profile.phase("parse"):
+        opened_reader = reader is None
+        if opened_reader:
+            # Incremental updates only read the pages and the objects they change.
+            reader = open_pdf_reader(input_pdf_path, from_file=incremental)
+
+        # Get PDF dimensions for each page
+        pdf_dimensions = {}
+        for i, page in enumerate(reader.pages):
+            mediabox = page.mediabox
+            pdf_dimensions[i + 1] = [mediabox.width, mediabox.height]
     
+    # Transform the entry boxes of all fields, one page at a time.
+    form_fields = fields_data["form_fields"]
+    page_info_by_number = {p["page_number"]: p for p in fields_data["pages"]}
+    field_indices_by_page = {}
+    for i, field in enumerate(form_fields):
+        field_indices_by_page.setdefault(field["page_number"], []).append(i)
+
+    transformed_entry_boxes = [None] * len(form_fields)
+    with pdf_profile.phase("transform"):
+        for page_num, field_indices in field_indices_by_page.items():
+            page_info = page_info_by_number[page_num]
+            pdf_width, pdf_height = pdf_dimensions[page_num]
+            page_boxes = transform_page_boxes(
+                [form_fields[i]["entry_bounding_box"] for i in field_indices],
+                page_info["image_width"], page_info["image_height"],
+                pdf_width, pdf_height
+            )
+            for i, box in zip(field_indices, page_boxes):
+                transformed_entry_boxes[i] = box
+
     # Process each form field
     annotations = []
-    for field in fields_data["form_fields"]:
+    for field, transformed_entry_box in zip(form_fields, transformed_entry_boxes):
         page_num = field["page_number"]
         
-        # Get page dimensions and transform coordinates.
-        page_info = next(p for p in fields_data["pages"] if p["page_number"] == page_num)
-        image_width = page_info["image_width"]
-        image_height = page_info["image_height"]
-        pdf_width, pdf_height = pdf_dimensions[page_num]
-        
-        transformed_entry_box = transform_coordinates(
-            field["entry_bounding_box"],
-            image_width, image_height,
-            pdf_width, pdf_height
-        )
-        
         # Skip empty fields
         if "entry_text" not in field or "text" not in field["entry_text"]:
             continue
@@ -85,24 +152,40 @@ def fill_pdf_form(input_pdf_path, fields_json_path, output_pdf_path):
             border_color=None,
             background_color=None,
         )
-        annotations.append(annotation)
-        # page_number is 0-based for pypdf
-        writer.add_annotation(page_number=page_num - 1, annotation=annotation)
-        
-    # Save the filled PDF
-    with open(output_pdf_path, "wb") as output:
-        writer.write(output)
+        annotations.append((page_num, annotation))
+
+    with pdf_profile.phase("write"):
+        if incremental:
+            add_annotations_incrementally(reader, input_pdf_path, annotations, output_pdf_path)
+            if opened_reader:
+                reader.stream.close()
+        else:
+            writer = PdfWriter()
+
+            # Copy all pages to writer
+            writer.append(reader)
+
+            for page_num, annotation in annotations:
+                # page_number is 0-based for pypdf
+                writer.add_annotation(page_number=page_num - 1, annotation=annotation)
+
+            # Save the filled PDF
+            with open(output_pdf_path, "wb") as output:
+                writer.write(output)
     
     print(f"Successfully filled PDF form and saved to {output_pdf_path}")
     print(f"Added {len(annotations)} text annotations")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: fill_pdf_form_with_annotations.py [input pdf] [fields.json] [output pdf]")
+    pdf_profile.enable_from_argv(sys.argv)
+    enable_mmap_from_argv(sys.argv)
+    args = [arg for arg in sys.argv[1:] if arg != "--incremental"]
+    if len(args) != 3:
+        print("Usage: fill_pdf_form_with_annotations.py [--incremental] [--profile] [--mmap] [input pdf] [fields.json] [output pdf]")
         sys.exit(1)
-    input_pdf = sys.argv[1]
-    fields_json = sys.argv[2]
-    output_pdf = sys.argv[3]
+    input_pdf = args[0]
+    fields_json = args[1]
+    output_pdf = args[2]
     
-    fill_pdf_form(input_pdf, fields_json, output_pdf)
\ No newline at end of file
+    fill_pdf_form(input_pdf, fields_json, output_pdf, incremental="--incremental" in sys.argv[1:])
\ No newline at end of file
@@ -0,0 +1,29 @@
+import os
+
+
+# Output formats for the page images written by convert_pdf_to_images.py and the validation
+# images written by create_validation_image.py. All of them are lossless:
+#   png:  zlib-compressed; `compress_level` trades size for speed (Pillow's default is 6)
+#   webp: lossless WebP at its fastest setting, usually smaller than PNG and faster to write
+#   ppm:  uncompressed, the fastest to write and read, for piping into other tools
+
+IMAGE_FORMATS = ("png", "webp", "ppm")
+
+# Compression level 1 is much faster than Pillow's default for scanned and rendered pages,
+# and the files are only slightly larger.
+DEFAULT_PNG_COMPRESS_LEVEL = 1
+
+
+# Saves `image` to `path` in the format given by the path's extension.
+def save_image(image, path, compress_level=DEFAULT_PNG_COMPRESS_LEVEL):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".png":
+        image.save(path, "PNG", compress_level=compress_level)
+    elif extension == ".webp":
+        image.save(path, "WEBP", lossless=True, method=0, quality=50)
+    elif extension == ".ppm":
+        if image.mode not in ("1", "L", "RGB"):
+            image = image.convert("RGB")
+        image.save(path, "PPM")
+    else:
+        image.save(path)
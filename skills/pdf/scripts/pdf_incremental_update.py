@@ -0,0 +1,139 @@
+import os
+import re
+import shutil
+
+from pypdf.generic import ArrayObject, DictionaryObject, NameObject, NumberObject
+
+
+# Writes PDF incremental updates: the original file's bytes are kept as they are, and new or
+# modified objects are appended after them along with a cross-reference section covering
+# only those objects. Used by fill_pdf_form_with_annotations.py and fill_fillable_fields.py
+# so that output cost scales with what changed rather than with the size of the document.
+# The new section is of the same kind as the file's last one: a classic `xref` table and
+# trailer, or a cross-reference stream for files that use them (PDF 1.5 and later).
+
+# How far back from the end of the file `find_startxref` reads at a time.
+_STARTXREF_CHUNK = 4096
+
+
+def find_startxref(pdf_path):
+    """Return the byte offset of the last cross-reference section in a PDF file"""
+    # Reads backwards from the end of the file until the last `startxref` marker is found;
+    # some files have a long tail of padding or garbage after it.
+    with open(pdf_path, "rb") as f:
+        end = f.seek(0, os.SEEK_END)
+        start = end
+        while start > 0:
+            start = max(0, start - _STARTXREF_CHUNK)
+            f.seek(start)
+            pos = f.read(end - start).rfind(b"startxref")
+            if pos >= 0:
+                f.seek(start + pos + len(b"startxref"))
+                offset = f.read(32).split()[:1]
+                if offset and offset[0].isdigit():
+                    return int(offset[0])
+                raise ValueError(f"Malformed startxref in {pdf_path}")
+            # Overlap the next chunk with this one so that a marker split across them is found.
+            end = start + len(b"startxref")
+    raise ValueError(f"No startxref found in {pdf_path}; it may not be a PDF file or may be truncated")
+
+
+def uses_xref_stream(pdf_path, xref_offset):
+    """Return whether the cross-reference section at `xref_offset` is a cross-reference stream"""
+    with open(pdf_path, "rb") as f:
+        f.seek(xref_offset)
+        head = f.read(64).lstrip()
+    if head.startswith(b"xref"):
+        return False
+    if re.match(rb"\d+\s+\d+\s+obj\b", head):
+        return True
+    raise ValueError(f"No cross-reference section at offset {xref_offset} in {pdf_path}")
+
+
+def _subsections(ids):
+    # Splits sorted object numbers into (first, count) runs of consecutive numbers.
+    runs = []
+    for idnum in ids:
+        if runs and runs[-1][0] + runs[-1][1] == idnum:
+            runs[-1][1] += 1
+        else:
+            runs.append([idnum, 1])
+    return runs
+
+
+def write_incremental_update(reader, input_pdf_path, updated_objects, size, output_pdf_path):
+    """Append `updated_objects` to the PDF read by `reader` as an incremental update"""
+    # `updated_objects` maps object numbers to (generation, object) for every new or modified
+    # object, and `size` is one more than the highest object number in the updated file.
+    # If the output is the input file, the update is appended in place; otherwise the
+    # original is copied first (with a kernel-side copy where the OS supports it).
+    if reader.is_encrypted:
+        raise ValueError("Incremental updates of encrypted PDFs are not supported")
+
+    prev_xref = find_startxref(input_pdf_path)
+    xref_stream = uses_xref_stream(input_pdf_path, prev_xref)
+    if not os.path.exists(output_pdf_path) or not os.path.samefile(input_pdf_path, output_pdf_path):
+        shutil.copyfile(input_pdf_path, output_pdf_path)
+
+    with open(output_pdf_path, "r+b") as f:
+        f.seek(0, os.SEEK_END)
+        f.write(b"\n")
+        offsets = {}
+        for idnum in sorted(updated_objects):
+            generation, obj = updated_objects[idnum]
+            offsets[idnum] = f.tell()
+            f.write(f"{idnum} {generation} obj\n".encode())
+            obj.write_to_stream(f)
+            f.write(b"\nendobj\n")
+
+        xref_pos = f.tell()
+        trailer = DictionaryObject({
+            NameObject("/Prev"): NumberObject(prev_xref),
+            NameObject("/Root"): reader.trailer.raw_get("/Root"),
+        })
+        for key in ("/Info", "/ID"):
+            if key in reader.trailer:
+                trailer[NameObject(key)] = reader.trailer.raw_get(key)
+
+        if xref_stream:
+            _write_xref_stream(f, trailer, offsets, updated_objects, size, xref_pos)
+        else:
+            _write_xref_table(f, trailer, offsets, updated_objects, size)
+        f.write(f"\nstartxref\n{xref_pos}\n%%EOF\n".encode())
+
+
+def _write_xref_table(f, trailer, offsets, updated_objects, size):
+    # Object 0 heads the free list; starting the section with it keeps readers that expect
+    # zero-indexed tables from renumbering the entries.
+    f.write(b"xref\n0 1\n0000000000 65535 f\r\n")
+    for first, count in _subsections(sorted(offsets)):
+        f.write(f"{first} {count}\n".encode())
+        for idnum in range(first, first + count):
+            f.write(f"{offsets[idnum]:010d} {updated_objects[idnum][0]:05d} n\r\n".encode())
+    trailer[NameObject("/Size")] = NumberObject(size)
+    f.write(b"trailer\n")
+    trailer.write_to_stream(f)
+
+
+def _write_xref_stream(f, trailer, offsets, updated_objects, size, xref_pos):
+    # The stream is itself a new object, numbered `size`, with an entry of its own. Entries
+    # are type 1 (in use, at a byte offset), uncompressed.
+    xref_id = size
+    entries = {idnum: (offsets[idnum], updated_objects[idnum][0]) for idnum in offsets}
+    entries[xref_id] = (xref_pos, 0)
+    offset_width = max(1, (xref_pos.bit_length() + 7) // 8)
+    ids = sorted(entries)
+    data = b"".join(
+        b"\x01" + entries[idnum][0].to_bytes(offset_width, "big") + entries[idnum][1].to_bytes(2, "big")
+        for idnum in ids
+    )
+    trailer.update({
+        NameObject("/Type"): NameObject("/XRef"),
+        NameObject("/Size"): NumberObject(xref_id + 1),
+        NameObject("/Index"): ArrayObject(NumberObject(n) for run in _subsections(ids) for n in run),
+        NameObject("/W"): ArrayObject([NumberObject(1), NumberObject(offset_width), NumberObject(2)]),
+        NameObject("/Length"): NumberObject(len(data)),
+    })
+    f.write(f"{xref_id} 0 obj\n".encode())
+    trailer.write_to_stream(f)
+    f.write(b"\nstream\n" + data + b"\nendstream\nendobj")
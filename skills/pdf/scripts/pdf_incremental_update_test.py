@@ -0,0 +1,194 @@
+import unittest
+import contextlib
+import io
+import json
+import os
+import re
+import tempfile
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+from extract_form_field_info import get_field_info
+from fill_fillable_fields import fill_pdf_fields
+from pdf_incremental_update import (
+    _STARTXREF_CHUNK,
+    find_startxref,
+    uses_xref_stream,
+    write_incremental_update,
+)
+from synthetic_forms import make_field_values, make_fillable_form
+
+
+def make_xref_table_pdf(path, pages=2):
+    """Helper to write a PDF whose only cross-reference section is a classic `xref` table"""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(200, 200)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def make_xref_stream_pdf(path, pages=2):
+    """Helper to write a PDF whose last cross-reference section is a cross-reference stream"""
+    buffer = io.BytesIO()
+    writer = PdfWriter()
+    writer.add_blank_page(200, 200)
+    writer.write(buffer)
+    # pypdf writes incremental updates with a cross-reference stream.
+    writer = PdfWriter(io.BytesIO(buffer.getvalue()), incremental=True)
+    for _ in range(pages - 1):
+        writer.add_blank_page(100, 100)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def find_startxref_in_bytes(data):
+    return int(data[data.rindex(b"startxref"):].split()[1])
+
+
+def last_section_entry(data, key):
+    """Helper to read an integer entry of the last trailer or cross-reference stream dictionary"""
+    # pypdf's `reader.trailer` merges the sections and drops /Prev, so this reads the bytes.
+    section = data[find_startxref_in_bytes(data):data.rindex(b"startxref")].split(b"stream")[0]
+    match = re.search(rb"/" + key.encode() + rb"\s+(\d+)", section)
+    return int(match.group(1)) if match else None
+
+
+# Currently this is not run automatically in CI; it's just for documentation and manual checking.
+class TestWriteIncrementalUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def rotate_first_page_and_add_annotation(self, input_path, output_path):
+        """Helper that changes page 1 and adds a new object referenced from it"""
+        with open(input_path, "rb") as f:
+            reader = PdfReader(f)
+            page = reader.pages[0]
+            new_id = int(reader.trailer["/Size"])
+            page[NameObject("/Rotate")] = NumberObject(90)
+            page[NameObject("/Annots")] = ArrayObject([IndirectObject(new_id, 0, reader)])
+            annotation = DictionaryObject({
+                NameObject("/Type"): NameObject("/Annot"),
+                NameObject("/Subtype"): NameObject("/Text"),
+                NameObject("/Rect"): ArrayObject([NumberObject(n) for n in (10, 10, 20, 20)]),
+            })
+            updated_objects = {
+                page.indirect_reference.idnum: (page.indirect_reference.generation, page),
+                new_id: (0, annotation),
+            }
+            write_incremental_update(reader, input_path, updated_objects, new_id + 1, output_path)
+        return new_id
+
+    def check_update(self, input_path, output_path, original, expect_xref_stream):
+        new_id = self.rotate_first_page_and_add_annotation(input_path, output_path)
+        updated = read_bytes(output_path)
+        self.assertTrue(updated.startswith(original))
+        self.assertGreater(len(updated), len(original))
+
+        reader = PdfReader(output_path, strict=True)
+        self.assertEqual(len(reader.pages), 2)
+        self.assertEqual(reader.pages[0]["/Rotate"], 90)
+        annotation = reader.pages[0]["/Annots"][0]
+        self.assertEqual(annotation.indirect_reference.idnum, new_id)
+        self.assertEqual(annotation.get_object()["/Subtype"], "/Text")
+        self.assertNotIn("/Rotate", reader.pages[1])
+        self.assertEqual(last_section_entry(updated, "Prev"), find_startxref_in_bytes(original))
+        self.assertEqual(last_section_entry(updated, "Size"), new_id + 1 + expect_xref_stream)
+        self.assertEqual(uses_xref_stream(output_path, find_startxref(output_path)), expect_xref_stream)
+
+    def test_xref_table(self):
+        make_xref_table_pdf(self.path("in.pdf"))
+        original = read_bytes(self.path("in.pdf"))
+        self.check_update(self.path("in.pdf"), self.path("out.pdf"), original, expect_xref_stream=False)
+        self.assertEqual(read_bytes(self.path("in.pdf")), original)
+
+    def test_xref_stream(self):
+        make_xref_stream_pdf(self.path("in.pdf"))
+        original = read_bytes(self.path("in.pdf"))
+        self.check_update(self.path("in.pdf"), self.path("out.pdf"), original, expect_xref_stream=True)
+        self.assertEqual(read_bytes(self.path("in.pdf")), original)
+
+    def test_update_in_place(self):
+        for make_pdf, expect_xref_stream in ((make_xref_table_pdf, False), (make_xref_stream_pdf, True)):
+            with self.subTest(make_pdf=make_pdf.__name__):
+                make_pdf(self.path("in.pdf"))
+                original = read_bytes(self.path("in.pdf"))
+                self.check_update(self.path("in.pdf"), self.path("in.pdf"), original, expect_xref_stream)
+
+    def test_second_update_chains_to_first(self):
+        make_xref_table_pdf(self.path("in.pdf"))
+        self.rotate_first_page_and_add_annotation(self.path("in.pdf"), self.path("once.pdf"))
+        once = read_bytes(self.path("once.pdf"))
+        self.rotate_first_page_and_add_annotation(self.path("once.pdf"), self.path("twice.pdf"))
+        self.assertTrue(read_bytes(self.path("twice.pdf")).startswith(once))
+        reader = PdfReader(self.path("twice.pdf"), strict=True)
+        self.assertEqual(last_section_entry(read_bytes(self.path("twice.pdf")), "Prev"), find_startxref_in_bytes(once))
+        self.assertEqual(len(reader.pages[0]["/Annots"]), 1)
+
+
+class TestFindStartxref(unittest.TestCase):
+
+    def test_trailing_padding(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "padded.pdf")
+            make_xref_table_pdf(path)
+            expected = find_startxref(path)
+            # More than one chunk of padding, and a marker that straddles a chunk boundary
+            for padding in (_STARTXREF_CHUNK * 3, _STARTXREF_CHUNK - 5):
+                with self.subTest(padding=padding):
+                    make_xref_table_pdf(path)
+                    with open(path, "ab") as f:
+                        f.write(b"\0" * padding)
+                    self.assertEqual(find_startxref(path), expected)
+
+    def test_not_a_pdf(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "garbage.pdf")
+            with open(path, "wb") as f:
+                f.write(b"not a pdf\n" * 1000)
+            with self.assertRaises(ValueError):
+                find_startxref(path)
+
+
+class TestLazyFill(unittest.TestCase):
+
+    def test_lazy_fill_appends_field_values(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            form_pdf = os.path.join(tmp, "form.pdf")
+            values_json = os.path.join(tmp, "values.json")
+            output_pdf = os.path.join(tmp, "out.pdf")
+            make_fillable_form(form_pdf, 3, 10)
+            # Fill only the fields on page 2
+            values = [v for v in make_field_values(get_field_info(PdfReader(form_pdf))) if v["page"] == 2]
+            with open(values_json, "w") as f:
+                json.dump(values, f)
+            with contextlib.redirect_stdout(io.StringIO()):
+                fill_pdf_fields(form_pdf, values_json, output_pdf, lazy=True)
+
+            original = read_bytes(form_pdf)
+            updated = read_bytes(output_pdf)
+            self.assertTrue(updated.startswith(original))
+            self.assertEqual(last_section_entry(updated, "Prev"), find_startxref_in_bytes(original))
+            reader = PdfReader(output_pdf, strict=True)
+            self.assertTrue(reader.trailer["/Root"]["/AcroForm"]["/NeedAppearances"])
+            fields = reader.get_fields()
+            for value in values:
+                self.assertEqual(fields[value["field_id"]].get("/V"), value["value"])
+            filled = {value["field_id"] for value in values}
+            self.assertTrue(all("/V" not in field for field_id, field in fields.items() if field_id not in filled))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import mmap
+import os
+
+from pypdf import PdfReader
+
+
+# Opens input PDFs for the extraction and filling scripts. By default pypdf reads the whole
+# file into a private in-memory buffer. When the PDF_MMAP environment variable is set, or a
+# script is run with `--mmap`, files are memory-mapped read-only instead: the OS pages in the
+# parts of the file that pypdf actually touches, and processes that open the same file (such
+# as bulk fill workers sharing a template) share one copy in the page cache rather than each
+# holding their own. The setting is inherited by worker processes.
+# A mapped file must not be truncated or rewritten while it is being read; appending to it,
+# as incremental updates do, is fine. Writes that replace a whole file therefore call
+# `check_output_is_not_input` first.
+
+MMAP_ENV_VAR = "PDF_MMAP"
+
+
+# Removes `--mmap` from `argv` if present and turns memory-mapped input on.
+def enable_mmap_from_argv(argv):
+    if "--mmap" in argv:
+        argv.remove("--mmap")
+        os.environ[MMAP_ENV_VAR] = "1"
+
+
+# With `from_file`, a reader that isn't memory-mapped reads from an open file handle instead of
+# loading the whole file, so pypdf only reads the objects that are used. The caller closes it
+# with `reader.stream.close()`.
+def open_pdf_reader(pdf_path, from_file=False) -> PdfReader:
+    if not os.environ.get(MMAP_ENV_VAR):
+        return PdfReader(open(pdf_path, "rb")) if from_file else PdfReader(pdf_path)
+    with open(pdf_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # Empty files can't be mapped; let pypdf report the error.
+            return PdfReader(pdf_path)
+        # The mapping stays valid after the file is closed and is released with the reader.
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return PdfReader(mapped)
+
+
+# With memory-mapped input, rewriting the input PDF in place would truncate the mapping while
+# pypdf is still reading from it, which crashes the process with SIGBUS instead of raising.
+# Raises ValueError if `output_pdf_path` is the same file as `input_pdf_path` in that case.
+def check_output_is_not_input(input_pdf_path, output_pdf_path):
+    if not os.environ.get(MMAP_ENV_VAR) or not os.path.exists(output_pdf_path):
+        return
+    if os.path.samefile(input_pdf_path, output_pdf_path):
+        raise ValueError(f"{output_pdf_path} is the input PDF; with --mmap the output must be a different file")
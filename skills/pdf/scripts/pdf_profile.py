@@ -0,0 +1,89 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# Opt-in timing for the PDF form scripts. Profiling is on when the PDF_PROFILE environment
+# variable is set, or when a script is run with `--profile`. Each instrumented phase (parse,
+# field_resolution, transform, rasterize, resize, draw, write, validate) then writes a JSON line with
+# its wall time, CPU time and the process's peak RSS so far:
+#   {"script": "convert_pdf_to_images.py", "pid": 123, "phase": "rasterize", "wall_s": 1.2,
+#    "cpu_s": 1.1, "peak_rss_mb": 210.5, "page": 3}
+# PDF_PROFILE=1 writes the lines to stderr; any other value is a file path to append them
+# to. The setting is inherited by worker processes, which append to the same destination.
+# When profiling is off, `phase` does nothing beyond the context manager call.
+
+PROFILE_ENV_VAR = "PDF_PROFILE"
+
+
+def enabled():
+    return bool(os.environ.get(PROFILE_ENV_VAR))
+
+
+# Removes `--profile` from `argv` if present and turns profiling on (writing to stderr
+# unless PDF_PROFILE already names a file).
+def enable_from_argv(argv):
+    if "--profile" in argv:
+        argv.remove("--profile")
+        enable()
+
+
+def enable(destination="1"):
+    os.environ.setdefault(PROFILE_ENV_VAR, destination)
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _cpu_seconds():
+    # Includes finished child processes, such as pdftoppm when rasterizing.
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _write_record(record):
+    line = json.dumps(record) + "\n"
+    destination = os.environ.get(PROFILE_ENV_VAR)
+    if destination == "1":
+        sys.stderr.write(line)
+        sys.stderr.flush()
+    else:
+        # One write per line in append mode, so lines from worker processes don't interleave.
+        with open(destination, "a") as f:
+            f.write(line)
+
+
+# Times the enclosed block as `name`; `details` (such as a page number) are added to the
+# record.
+@contextmanager
+def phase(name, **details):
+    if not enabled():
+        yield
+        return
+    wall_start = time.perf_counter()
+    cpu_start = _cpu_seconds()
+    try:
+        yield
+    finally:
+        record = {
+            "script": os.path.basename(sys.argv[0]),
+            "pid": os.getpid(),
+            "phase": name,
+            "wall_s": round(time.perf_counter() - wall_start, 6),
+            "cpu_s": round(_cpu_seconds() - cpu_start, 6),
+            "peak_rss_mb": _peak_rss_mb(),
+        }
+        record.update(details)
+        _write_record(record)
@@ -0,0 +1,188 @@
+import contextlib
+import io
+import json
+import os
+import socketserver
+import stat
+import sys
+import traceback
+from collections import OrderedDict
+
+from check_bounding_boxes import get_bounding_box_messages
+from check_fillable_fields import has_fillable_fields
+from convert_pdf_to_images import PageImageCache, convert
+from create_validation_image import create_validation_image, create_validation_images
+from extract_form_field_info import enable_field_info_cache_from_argv, get_field_info_cached
+from fill_fillable_fields import fill_pdf_fields, monkeypatch_pydpf_method
+from fill_pdf_form_with_annotations import fill_pdf_form
+from pdf_input import enable_mmap_from_argv, open_pdf_reader
+from propose_fields import propose_fields
+
+
+# A long-running process that serves the steps of the forms.md workflow, so that a loop of
+# many small calls doesn't pay for starting Python and importing pypdf, PIL and pdf2image
+# each time. Requests and responses are JSON objects, one per line:
+#   {"id": 1, "method": "extract", "params": {"pdf_path": "form.pdf"}}
+#   {"id": 1, "result": {"fields": [...]}, "output": ""}
+# or, if the request fails:
+#   {"id": 1, "error": {"type": "ValueError", "message": "..."}, "output": "..."}
+# "output" is whatever the step printed (such as validation errors). The methods and their
+# parameters are listed in `METHODS`. Requests are read from stdin and responses written to
+# stdout, or with `--socket PATH` the worker listens on a Unix socket and serves one
+# connection at a time with the same protocol.
+
+
+# Least recently used cache of parsed PDFs, keyed by path, size and mtime so that a file
+# that changes on disk is parsed again.
+class ReaderCache:
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.readers = OrderedDict()
+
+    def get(self, pdf_path):
+        st = os.stat(pdf_path)
+        key = (os.path.realpath(pdf_path), st.st_size, st.st_mtime_ns)
+        reader = self.readers.get(key)
+        if reader is None:
+            reader = open_pdf_reader(pdf_path)
+            self.readers[key] = reader
+            while len(self.readers) > self.max_entries:
+                self.readers.popitem(last=False)
+        else:
+            self.readers.move_to_end(key)
+        return reader
+
+
+readers = ReaderCache()
+
+
+def extract(pdf_path, output_path=None):
+    field_info = get_field_info_cached(pdf_path, readers.get(pdf_path))
+    if output_path:
+        with open(output_path, "w") as f:
+            json.dump(field_info, f, indent=2)
+    return {"fields": field_info}
+
+
+def fill(input_pdf_path, field_values_path, output_pdf_path, lazy=False):
+    reader = None if lazy else readers.get(input_pdf_path)
+    fill_pdf_fields(input_pdf_path, field_values_path, output_pdf_path, lazy=lazy, reader=reader)
+    return {"output_pdf_path": output_pdf_path}
+
+
+def validate(fields_json_path):
+    with open(fields_json_path) as f:
+        return {"messages": get_bounding_box_messages(f)}
+
+
+def validation_image(fields_json_path, input_path, output_path, page_number=None, mode="full", image_format="png"):
+    # Without a page number, `input_path` and `output_path` are directories and every page is
+    # drawn, as with `create_validation_image.py --all`.
+    if page_number is None:
+        create_validation_images(fields_json_path, input_path, output_path, mode=mode, image_format=image_format)
+    else:
+        create_validation_image(page_number, fields_json_path, input_path, output_path, mode=mode)
+    return {"output_path": output_path}
+
+
+def rasterize(pdf_path, output_dir, max_dim=1000, fast=False, cache_dir=None, image_format="png", encode_threads=0):
+    cache = PageImageCache(cache_dir) if cache_dir else None
+    convert(pdf_path, output_dir, max_dim, fast=fast, cache=cache, image_format=image_format, encode_threads=encode_threads)
+    return {"output_dir": output_dir}
+
+
+def annotate(input_pdf_path, fields_json_path, output_pdf_path, incremental=False):
+    # Incremental updates modify the reader's pages, so they get a reader of their own.
+    reader = None if incremental else readers.get(input_pdf_path)
+    fill_pdf_form(input_pdf_path, fields_json_path, output_pdf_path, incremental=incremental, reader=reader)
+    return {"output_pdf_path": output_pdf_path}
+
+
+def check_fillable(pdf_path):
+    return {"fillable": has_fillable_fields(pdf_path)}
+
+
+def propose(pdf_path, output_path, max_dim=1000, image_dir=None):
+    form_fields = propose_fields(pdf_path, output_path, max_dim=max_dim, image_dir=image_dir)
+    return {"output_path": output_path, "field_count": len(form_fields)}
+
+
+METHODS = {
+    "extract": extract,
+    "fill": fill,
+    "validate": validate,
+    "validation_image": validation_image,
+    "rasterize": rasterize,
+    "annotate": annotate,
+    "check_fillable": check_fillable,
+    "propose": propose,
+}
+
+
+# Handles one request line and returns the response object.
+def handle_request(line):
+    request_id = None
+    try:
+        request = json.loads(line)
+        request_id = request.get("id")
+        method = METHODS[request["method"]]
+        params = request.get("params", {})
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return {"id": request_id, "error": {"type": "InvalidRequest", "message": f"{type(e).__name__}: {e}"}}
+
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            result = method(**params)
+        return {"id": request_id, "result": result, "output": output.getvalue()}
+    except SystemExit as e:
+        # The scripts exit with an error status after printing validation errors.
+        return {"id": request_id, "error": {"type": "SystemExit", "message": f"exit status {e.code}"}, "output": output.getvalue()}
+    except Exception as e:
+        traceback.print_exc(file=sys.stderr)
+        return {"id": request_id, "error": {"type": type(e).__name__, "message": str(e)}, "output": output.getvalue()}
+
+
+def serve(input_stream, output_stream):
+    for line in input_stream:
+        if not line.strip():
+            continue
+        output_stream.write(json.dumps(handle_request(line)) + "\n")
+        output_stream.flush()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        serve(io.TextIOWrapper(self.rfile, encoding="utf-8"), io.TextIOWrapper(self.wfile, encoding="utf-8"))
+
+
+def serve_unix_socket(socket_path):
+    # A socket left behind by an earlier worker is replaced; anything else at the path is an
+    # error rather than something to delete.
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        mode = None
+    if mode is not None:
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError(f"{socket_path} exists and is not a socket")
+        os.remove(socket_path)
+    with socketserver.UnixStreamServer(socket_path, _RequestHandler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    monkeypatch_pydpf_method()
+    enable_mmap_from_argv(sys.argv)
+    enable_field_info_cache_from_argv(sys.argv)
+    if len(sys.argv) == 3 and sys.argv[1] == "--socket":
+        serve_unix_socket(sys.argv[2])
+    elif len(sys.argv) == 1:
+        serve(sys.stdin, sys.stdout)
+    else:
+        print("Usage: pdf_worker.py [--mmap] [--cache-dir dir] (reads JSON requests from stdin)")
+        print("   or: pdf_worker.py [--mmap] [--cache-dir dir] --socket [socket path]")
+        sys.exit(1)
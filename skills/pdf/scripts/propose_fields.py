@@ -0,0 +1,395 @@
+import json
+import math
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from PIL import Image
+from pypdf.generic import ContentStream
+
+import pdf_profile
+from convert_pdf_to_images import page_image_size
+from pdf_input import enable_mmap_from_argv, open_pdf_reader
+
+
+# Drafts a `fields.json` (see forms.md) for a PDF without fillable fields from the text and
+# lines drawn in its page content streams, without rasterizing or OCR. Labels are the text
+# runs on the page; entry boxes are proposed for the blank areas that forms use for input:
+#   - runs of underscores ("Email: ________"), with the text before them as the label
+#   - horizontal lines, labelled by the text before, under or above them
+#   - small squares (checkboxes), labelled by the text next to them
+#   - the space after a label inside a box ("Name:" in a bordered cell)
+#   - the space after any other label that ends with a colon
+# The result is a starting point for the visual analysis in forms.md: boxes are placed from
+# estimated text widths, text in images and form XObjects isn't seen, and fields have no
+# `entry_text` yet. Every page is analyzed in its own worker process.
+
+# Width of each character in ems, used when a font has no /Widths. These are close to
+# Helvetica's, the most common font in forms.
+_NARROW_CHARS = frozenset(" .,:;'|!ijlIft()[]")
+_WIDE_CHARS = frozenset("mwMW@%")
+UNDERSCORE_WIDTH = 0.556
+
+# Top and bottom of text relative to its baseline, in ems.
+ASCENT = 0.8
+DESCENT = 0.25
+
+# In points.
+MIN_RULE_LENGTH = 36
+MIN_ENTRY_WIDTH = 20
+MIN_ENTRY_HEIGHT = 6
+MAX_ENTRY_HEIGHT = 36
+MIN_CHECKBOX_SIZE = 5
+MAX_CHECKBOX_SIZE = 20
+BOX_GAP = 2
+PAGE_MARGIN = 36
+
+# A run of this many underscores is an entry area; two or more spaces separate labels.
+_SEPARATOR = re.compile(r"_{3,}|\s{2,}")
+
+
+@dataclass
+class TextSegment:
+    text: str
+    left: float
+    right: float
+    baseline: float
+    font_size: float
+
+    @property
+    def top(self):
+        return self.baseline + ASCENT * self.font_size
+
+    @property
+    def bottom(self):
+        return self.baseline - DESCENT * self.font_size
+
+    @property
+    def box(self):
+        return (self.left, self.bottom, self.right, self.top)
+
+
+def _multiply(m, n):
+    return [
+        m[0] * n[0] + m[1] * n[2],
+        m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2],
+        m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4],
+        m[4] * n[1] + m[5] * n[3] + n[5],
+    ]
+
+
+def _char_widths(font_dict):
+    # Returns a function giving the width in ems of a character of the font.
+    widths = font_dict.get("/Widths") if font_dict else None
+    first_char = font_dict.get("/FirstChar") if font_dict else None
+    if widths is not None and first_char is not None and font_dict.get("/Subtype") != "/Type0":
+        widths = [float(w) / 1000 for w in widths.get_object()]
+        first_char = int(first_char)
+    else:
+        widths = None
+
+    def width(char):
+        if widths is not None and 0 <= ord(char) - first_char < len(widths) and widths[ord(char) - first_char] > 0:
+            return widths[ord(char) - first_char]
+        if char == "_":
+            return UNDERSCORE_WIDTH
+        if char in _NARROW_CHARS:
+            return 0.28
+        if char in _WIDE_CHARS:
+            return 0.85
+        return 0.67 if char.isupper() else 0.52
+
+    return width
+
+
+# Returns the page's text as TextSegments and its underscore runs as (left, right, baseline,
+# font_size), in PDF coordinates. Text is split into segments at underscore runs and at gaps
+# of two or more spaces.
+def extract_text_segments(page):
+    segments = []
+    blanks = []
+
+    def visit(text, cm, tm, font_dict, font_size):
+        if not text.strip():
+            return
+        m = _multiply(tm, cm)
+        size = font_size * (math.hypot(m[2], m[3]) or 1)
+        x_scale = font_size * (math.hypot(m[0], m[1]) or 1)
+        width = _char_widths(font_dict)
+        for line_index, line in enumerate(text.split("\n")):
+            baseline = m[5] - line_index * size * 1.2
+            x = m[4]
+            position = 0
+            for match in list(_SEPARATOR.finditer(line)) + [None]:
+                end = match.start() if match else len(line)
+                piece = line[position:end]
+                stripped = piece.strip()
+                if stripped:
+                    left = x + sum(width(c) for c in piece[:len(piece) - len(piece.lstrip())]) * x_scale
+                    right = left + sum(width(c) for c in stripped) * x_scale
+                    segments.append(TextSegment(stripped, left, right, baseline, size))
+                x += sum(width(c) for c in piece) * x_scale
+                if match:
+                    match_width = sum(width(c) for c in match.group()) * x_scale
+                    if match.group().startswith("_"):
+                        blanks.append((x, x + match_width, baseline, size))
+                    x += match_width
+                    position = match.end()
+
+    page.extract_text(visitor_text=visit)
+    return segments, blanks
+
+
+# Returns the horizontal lines, checkbox squares and other rectangles stroked or filled in
+# the page's content stream, in PDF coordinates. Lines are (left, right, y); squares and
+# rectangles are (left, bottom, right, top). Thin filled rectangles count as lines.
+def extract_rules_and_boxes(page):
+    rules, squares, rects = [], [], []
+    contents = page.get_contents()
+    if contents is None:
+        return rules, squares, rects
+
+    ctm = [1, 0, 0, 1, 0, 0]
+    saved = []
+    path_lines, path_rects = [], []
+    current = None
+
+    def transform(x, y):
+        return (x * ctm[0] + y * ctm[2] + ctm[4], x * ctm[1] + y * ctm[3] + ctm[5])
+
+    for operands, operator in ContentStream(contents, page.pdf).operations:
+        if operator == b"q":
+            saved.append(ctm)
+        elif operator == b"Q":
+            ctm = saved.pop() if saved else [1, 0, 0, 1, 0, 0]
+        elif operator == b"cm":
+            ctm = _multiply([float(v) for v in operands], ctm)
+        elif operator == b"m":
+            current = transform(float(operands[0]), float(operands[1]))
+        elif operator == b"l":
+            point = transform(float(operands[0]), float(operands[1]))
+            if current is not None:
+                path_lines.append((current, point))
+            current = point
+        elif operator == b"re":
+            x, y, w, h = (float(v) for v in operands)
+            corners = [transform(x, y), transform(x + w, y + h)]
+            path_rects.append((
+                min(c[0] for c in corners), min(c[1] for c in corners),
+                max(c[0] for c in corners), max(c[1] for c in corners),
+            ))
+        elif operator in (b"S", b"s", b"f", b"F", b"f*", b"B", b"B*", b"b", b"b*", b"n"):
+            if operator != b"n":
+                for (x1, y1), (x2, y2) in path_lines:
+                    if abs(y1 - y2) <= 1 and abs(x2 - x1) >= MIN_RULE_LENGTH:
+                        rules.append((min(x1, x2), max(x1, x2), (y1 + y2) / 2))
+                for left, bottom, right, top in path_rects:
+                    width, height = right - left, top - bottom
+                    if height <= 2 and width >= MIN_RULE_LENGTH:
+                        rules.append((left, right, (bottom + top) / 2))
+                    elif MIN_CHECKBOX_SIZE <= min(width, height) and max(width, height) <= MAX_CHECKBOX_SIZE and abs(width - height) <= 2:
+                        squares.append((left, bottom, right, top))
+                    elif width >= MIN_ENTRY_WIDTH and height > MAX_CHECKBOX_SIZE:
+                        rects.append((left, bottom, right, top))
+            path_lines, path_rects, current = [], [], None
+    return rules, squares, rects
+
+
+def _boxes_intersect(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _overlaps_horizontally(segment, left, right):
+    return segment.left < right and left < segment.right
+
+
+# Returns the proposed fields for one page as (label segment, entry box, is_checkbox) in PDF
+# coordinates.
+def propose_page_fields(segments, blanks, rules, squares, rects, page_width):
+    fields = []
+    used_labels = set()
+    entries = []
+
+    def add(label, entry, is_checkbox=False):
+        left, bottom, right, top = entry
+        if label is None or id(label) in used_labels:
+            return False
+        if (not is_checkbox and right - left < MIN_ENTRY_WIDTH) or top - bottom < MIN_ENTRY_HEIGHT:
+            return False
+        if any(_boxes_intersect(entry, other) for other in entries):
+            return False
+        if any(_boxes_intersect(entry, segment.box) for segment in segments):
+            return False
+        used_labels.add(id(label))
+        entries.append(entry)
+        fields.append((label, entry, is_checkbox))
+        return True
+
+    def on_line(y, left):
+        # The nearest segment ending before `left` whose baseline is near `y`.
+        candidates = [s for s in segments if s.right <= left + 1 and s.bottom - 2 <= y <= s.top]
+        return max(candidates, key=lambda s: s.right, default=None)
+
+    def below(y, left, right):
+        candidates = [s for s in segments if _overlaps_horizontally(s, left, right) and y - 2 * s.font_size <= s.top <= y + 1]
+        return max(candidates, key=lambda s: s.top, default=None)
+
+    def above(y, left, right, limit):
+        candidates = [s for s in segments if _overlaps_horizontally(s, left, right) and y < s.bottom <= y + limit]
+        return min(candidates, key=lambda s: s.bottom, default=None)
+
+    # Underscores: the entry sits on the underscores, up to the height of the text.
+    for left, right, baseline, size in blanks:
+        entry = (left, baseline - DESCENT * size / 2, right, baseline + 1.2 * size)
+        add(on_line(baseline, left) or below(entry[1], left, right), entry)
+
+    # Lines: the entry sits on the line, up to the text above it.
+    for left, right, y in sorted(rules, key=lambda r: -r[2]):
+        text_above = above(y, left, right, MAX_ENTRY_HEIGHT)
+        top = min(y + MAX_ENTRY_HEIGHT / 2, text_above.bottom - BOX_GAP) if text_above else y + MAX_ENTRY_HEIGHT / 2
+        entry = (left, y + 1, right, top)
+        label = on_line(y, left) or below(y, left, right)
+        if label is None and text_above is not None:
+            # Label above the line: the entry fills the space between them.
+            entry = (left, y + 1, right, text_above.bottom - BOX_GAP)
+            label = text_above
+        add(label, entry)
+
+    # Checkboxes: labelled by the nearest text on the same line. In a row of boxes the labels
+    # are all on the same side, so a label to the left is only used when the last box in the
+    # row has no text after it.
+    rows = {}
+    for square in sorted(squares):
+        rows.setdefault(round((square[1] + square[3]) / 4), []).append(square)
+    for row in rows.values():
+        def after(square):
+            middle = (square[1] + square[3]) / 2
+            candidates = [s for s in segments if s.bottom <= middle <= s.top and 0 <= s.left - square[2] <= 3 * s.font_size]
+            return min(candidates, key=lambda s: s.left, default=None)
+
+        def before(square):
+            middle = (square[1] + square[3]) / 2
+            candidates = [s for s in segments if s.bottom <= middle <= s.top and 0 <= square[0] - s.right <= 3 * s.font_size]
+            return max(candidates, key=lambda s: s.right, default=None)
+
+        labels_before = after(row[-1]) is None
+        for square in row:
+            add((before if labels_before else after)(square) or after(square) or before(square), square, is_checkbox=True)
+
+    # Labels inside boxes: the entry fills the rest of the box.
+    for left, bottom, right, top in rects:
+        inside = [s for s in segments if left <= s.left and s.right <= right and bottom <= s.bottom and s.top <= top]
+        if len(inside) == 1:
+            label = inside[0]
+            add(label, (label.right + BOX_GAP, bottom + BOX_GAP, right - BOX_GAP, top - BOX_GAP))
+
+    # Remaining labels ending in a colon: the entry runs to the next text on the line or the
+    # page margin.
+    for label in segments:
+        if not label.text.endswith(":") or id(label) in used_labels:
+            continue
+        following = [s.left for s in segments if s.left > label.right and s.bottom < label.top and label.bottom < s.top]
+        entry_right = min(following, default=page_width - PAGE_MARGIN) - BOX_GAP
+        add(label, (label.right + BOX_GAP, label.bottom, entry_right, label.bottom + 1.2 * label.font_size))
+
+    return fields
+
+
+# Converts a box in PDF coordinates to [left, top, right, bottom] in image pixels, the inverse
+# of the transform in fill_pdf_form_with_annotations.py.
+def to_image_box(box, x_scale, y_scale, pdf_height):
+    left, bottom, right, top = box
+    return [
+        round(left * x_scale),
+        round((pdf_height - top) * y_scale),
+        round(right * x_scale),
+        round((pdf_height - bottom) * y_scale),
+    ]
+
+
+_reader = None
+
+
+def _init_worker(pdf_path):
+    global _reader
+    _reader = open_pdf_reader(pdf_path)
+
+
+# Returns the `form_fields` entries for one page. Runs in a worker process.
+def _propose_for_page(job):
+    page_number, image_width, image_height = job
+    page = _reader.pages[page_number - 1]
+    with pdf_profile.phase("parse", page=page_number):
+        segments, blanks = extract_text_segments(page)
+        rules, squares, rects = extract_rules_and_boxes(page)
+    pdf_width, pdf_height = float(page.mediabox.width), float(page.mediabox.height)
+    with pdf_profile.phase("field_resolution", page=page_number):
+        proposals = propose_page_fields(segments, blanks, rules, squares, rects, pdf_width)
+    x_scale, y_scale = image_width / pdf_width, image_height / pdf_height
+    form_fields = []
+    for label, entry, is_checkbox in sorted(proposals, key=lambda p: (-p[1][3], p[1][0])):
+        field_label = label.text.rstrip(":").strip() or label.text
+        form_fields.append({
+            "page_number": page_number,
+            "description": f"{'Checkbox' if is_checkbox else 'Entry'} for \"{field_label}\" (proposed, verify visually)",
+            "field_label": field_label,
+            "label_bounding_box": to_image_box(label.box, x_scale, y_scale, pdf_height),
+            "entry_bounding_box": to_image_box(entry, x_scale, y_scale, pdf_height),
+        })
+    return form_fields
+
+
+# Returns (image_width, image_height) for each page: the size of `page_N.*` in
+# `image_dir` when it exists, otherwise the size convert_pdf_to_images.py writes the page at
+# for `max_dim`.
+def page_image_sizes(reader, max_dim=1000, image_dir=None):
+    images = {}
+    if image_dir:
+        for name in os.listdir(image_dir):
+            match = re.fullmatch(r"page_(\d+)\.\w+", name)
+            if match:
+                images[int(match.group(1))] = os.path.join(image_dir, name)
+    sizes = []
+    for page_number, page in enumerate(reader.pages, start=1):
+        if page_number in images:
+            with Image.open(images[page_number]) as image:
+                sizes.append(image.size)
+            continue
+        sizes.append(page_image_size(page, max_dim))
+    return sizes
+
+
+def propose_fields(pdf_path, output_path, max_dim=1000, image_dir=None, max_workers=None):
+    reader = open_pdf_reader(pdf_path)
+    sizes = page_image_sizes(reader, max_dim, image_dir)
+    pages = [
+        {"page_number": page_number, "image_width": width, "image_height": height}
+        for page_number, (width, height) in enumerate(sizes, start=1)
+    ]
+    jobs = [(page["page_number"], page["image_width"], page["image_height"]) for page in pages]
+    form_fields = []
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(pdf_path,)) as executor:
+        for page_fields in executor.map(_propose_for_page, jobs):
+            form_fields.extend(page_fields)
+    with pdf_profile.phase("write"):
+        with open(output_path, "w") as f:
+            json.dump({"pages": pages, "form_fields": form_fields}, f, indent=2)
+    print(f"Proposed {len(form_fields)} fields on {len(pages)} pages; wrote {output_path}")
+    return form_fields
+
+
+if __name__ == "__main__":
+    pdf_profile.enable_from_argv(sys.argv)
+    enable_mmap_from_argv(sys.argv)
+    image_dir = None
+    if len(sys.argv) == 5 and sys.argv[3] == "--images":
+        image_dir = sys.argv[4]
+        del sys.argv[3:]
+    if len(sys.argv) != 3:
+        print("Usage: propose_fields.py [--profile] [--mmap] [input pdf] [output fields.json] [--images page image directory]")
+        sys.exit(1)
+    propose_fields(sys.argv[1], sys.argv[2], image_dir=image_dir)
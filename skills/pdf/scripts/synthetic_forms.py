@@ -0,0 +1,231 @@
+import json
+import random
+import sys
+
+from pypdf import PdfWriter
+from pypdf.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    NameObject,
+    NumberObject,
+    TextStringObject,
+)
+
+
+# Generates synthetic PDFs and fields.json files for benchmark.py. The outputs are
+# deterministic for a given seed, so timings from different runs compare the same inputs.
+
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+
+
+def _rect(left, bottom, width, height):
+    return ArrayObject([FloatObject(left), FloatObject(bottom), FloatObject(left + width), FloatObject(bottom + height)])
+
+
+def _widget(page, rect, **entries):
+    widget = DictionaryObject({
+        NameObject("/Type"): NameObject("/Annot"),
+        NameObject("/Subtype"): NameObject("/Widget"),
+        NameObject("/Rect"): rect,
+        NameObject("/P"): page.indirect_reference,
+    })
+    for key, value in entries.items():
+        widget[NameObject("/" + key)] = value
+    return widget
+
+
+def _on_off_appearances(on_state):
+    return DictionaryObject({NameObject("/N"): DictionaryObject({
+        NameObject(on_state): DictionaryObject(),
+        NameObject("/Off"): DictionaryObject(),
+    })})
+
+
+# Writes a PDF with an AcroForm of `fields_per_page` fields on each of `pages` pages. Most
+# fields are text fields and every fifth one is a checkbox; they are nested `nesting_depth`
+# levels below per-page group fields, so field IDs look like "p1.g0.f3". Each page also gets
+# `radio_groups_per_page` three-option radio groups and `choice_fields_per_page` choice
+# lists with `choice_options` options.
+def make_fillable_form(path, pages, fields_per_page, nesting_depth=2, radio_groups_per_page=1,
+                       choice_fields_per_page=1, choice_options=20, seed=0):
+    rng = random.Random(seed)
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(PAGE_WIDTH, PAGE_HEIGHT)
+    add = writer._add_object
+
+    font = add(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    default_appearance = TextStringObject("/Helv 0 Tf 0 g")
+    top_level_fields = ArrayObject()
+
+    for page_index in range(pages):
+        page = writer.pages[page_index]
+        annotations = ArrayObject()
+
+        # Chain of container fields that this page's text fields and checkboxes hang from.
+        parent = None
+        for level in range(nesting_depth):
+            name = f"p{page_index + 1}" if level == 0 else f"g{level}"
+            container = add(DictionaryObject({NameObject("/T"): TextStringObject(name), NameObject("/Kids"): ArrayObject()}))
+            if parent is None:
+                top_level_fields.append(container)
+            else:
+                container.get_object()[NameObject("/Parent")] = parent
+                parent.get_object()["/Kids"].append(container)
+            parent = container
+
+        rows = max(1, fields_per_page)
+        row_height = (PAGE_HEIGHT - 200) / rows
+        for k in range(fields_per_page):
+            bottom = PAGE_HEIGHT - 60 - (k + 1) * row_height
+            height = max(4, min(20, row_height - 2))
+            if k % 5 == 4:
+                field = _widget(page, _rect(300, bottom, min(15, height), min(15, height)),
+                                FT=NameObject("/Btn"), T=TextStringObject(f"cb{k}"),
+                                AP=_on_off_appearances("/Yes"), AS=NameObject("/Off"))
+            else:
+                field = _widget(page, _rect(100 + rng.randint(0, 50), bottom, 180, height),
+                                FT=NameObject("/Tx"), T=TextStringObject(f"f{k}"), DA=default_appearance)
+            if parent is not None:
+                field[NameObject("/Parent")] = parent
+            ref = add(field)
+            if parent is not None:
+                parent.get_object()["/Kids"].append(ref)
+            else:
+                top_level_fields.append(ref)
+            annotations.append(ref)
+
+        # Radio groups are terminal fields whose kids are unnamed widgets, one per option.
+        for g in range(radio_groups_per_page):
+            group = add(DictionaryObject({
+                NameObject("/FT"): NameObject("/Btn"),
+                NameObject("/Ff"): NumberObject(1 << 15),
+                NameObject("/T"): TextStringObject(f"radio_p{page_index + 1}_{g}"),
+                NameObject("/Kids"): ArrayObject(),
+            }))
+            top_level_fields.append(group)
+            for option in range(3):
+                widget = add(_widget(page, _rect(50 + option * 30, 100 - g * 20, 15, 15), Parent=group,
+                                     AP=_on_off_appearances(f"/option{option}"), AS=NameObject("/Off")))
+                group.get_object()["/Kids"].append(widget)
+                annotations.append(widget)
+
+        for c in range(choice_fields_per_page):
+            options = ArrayObject(
+                ArrayObject([TextStringObject(f"v{i}"), TextStringObject(f"Option {i}")]) for i in range(choice_options)
+            )
+            choice = add(_widget(page, _rect(300, 100 - c * 25, 150, 20), FT=NameObject("/Ch"),
+                                 T=TextStringObject(f"choice_p{page_index + 1}_{c}"), Opt=options,
+                                 DA=default_appearance))
+            top_level_fields.append(choice)
+            annotations.append(choice)
+
+        page[NameObject("/Annots")] = annotations
+
+    writer._root_object[NameObject("/AcroForm")] = add(DictionaryObject({
+        NameObject("/Fields"): top_level_fields,
+        NameObject("/DA"): default_appearance,
+        NameObject("/DR"): DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/Helv"): font})}),
+    }))
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+# Writes a PDF without form fields whose pages each have `lines_per_page` lines of text, for
+# the non-fillable workflow (rasterizing and adding annotations).
+def make_text_pdf(path, pages, lines_per_page=30):
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for page_index in range(pages):
+        page = writer.add_blank_page(PAGE_WIDTH, PAGE_HEIGHT)
+        commands = ["BT", "/F1 11 Tf"]
+        for line in range(lines_per_page):
+            y = PAGE_HEIGHT - 60 - line * ((PAGE_HEIGHT - 120) / max(1, lines_per_page))
+            commands.append(f"1 0 0 1 60 {y:.1f} Tm (Page {page_index + 1} label {line}: ________________) Tj")
+        commands.append("ET")
+        contents = DecodedStreamObject()
+        contents.set_data("\n".join(commands).encode())
+        page[NameObject("/Contents")] = writer._add_object(contents)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+        })
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+# Returns a field values list (the `field_values.json` format in forms.md) that sets every
+# field from `get_field_info` to a valid value.
+def make_field_values(field_info):
+    values = []
+    for field in field_info:
+        value = {"field_id": field["field_id"], "page": field["page"]}
+        if field["type"] == "checkbox":
+            value["value"] = field["checked_value"]
+        elif field["type"] == "radio_group":
+            value["value"] = field["radio_options"][-1]["value"]
+        elif field["type"] == "choice":
+            value["value"] = field["choice_options"][-1]["value"]
+        else:
+            value["value"] = f"Value for {field['field_id']}"
+        values.append(value)
+    return values
+
+
+# Returns a `fields.json` dict (the format in forms.md) with `fields_per_page` fields on
+# each page, laid out in rows of label and entry boxes that don't intersect and are tall
+# enough for their text, so that check_bounding_boxes.py does all of its checks.
+def make_fields_json(pages, fields_per_page, image_width=1000, image_height=1294, seed=0):
+    rng = random.Random(seed)
+    columns = 2
+    rows = max(1, -(-fields_per_page // columns))
+    row_height = image_height / rows
+    column_width = image_width / columns
+    box_height = max(1, int(row_height) - 2)
+    form_fields = []
+    for page_number in range(1, pages + 1):
+        for k in range(fields_per_page):
+            row, column = divmod(k, columns)
+            left = int(column * column_width)
+            top = int(row * row_height)
+            label_right = left + int(column_width * rng.uniform(0.2, 0.4))
+            form_fields.append({
+                "page_number": page_number,
+                "description": f"Field {k} on page {page_number}",
+                "field_label": f"Label {k}",
+                "label_bounding_box": [left, top, label_right, top + box_height],
+                "entry_bounding_box": [label_right + 2, top, int(left + column_width) - 2, top + box_height],
+                "entry_text": {"text": f"Value {k}", "font_size": max(1, min(14, box_height))},
+            })
+    return {
+        "pages": [
+            {"page_number": page_number, "image_width": image_width, "image_height": image_height}
+            for page_number in range(1, pages + 1)
+        ],
+        "form_fields": form_fields,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "form":
+        make_fillable_form(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+    elif len(sys.argv) == 4 and sys.argv[1] == "text":
+        make_text_pdf(sys.argv[2], int(sys.argv[3]))
+    elif len(sys.argv) == 5 and sys.argv[1] == "fields":
+        with open(sys.argv[2], "w") as f:
+            json.dump(make_fields_json(int(sys.argv[3]), int(sys.argv[4])), f, indent=2)
+    else:
+        print("Usage: synthetic_forms.py form [output pdf] [pages] [fields per page]")
+        print("   or: synthetic_forms.py text [output pdf] [pages]")
+        print("   or: synthetic_forms.py fields [output fields.json] [pages] [fields per page]")
+        sys.exit(1)
@@ -2,23 +2,428 @@
 """
 Pipeline Orchestrator
 Production-grade tool for senior data engineer
+
+Runs the tasks defined in a pipeline config as a DAG: tasks whose dependencies
+have finished run concurrently on a thread or process pool, each with its own
+retries and timeout. The config is JSON (or YAML, if PyYAML is installed):
+
+    {
+      "executor": "thread",
+      "max_workers": 4,
+      "tasks": [
+        {"name": "extract", "command": "python extract.py {input}", "retries": 2, "timeout": 600},
+        {"name": "clean", "callable": "transforms:clean", "args": {"dedupe": true},
+         "depends_on": ["extract"]},
+        {"name": "load", "command": ["python", "load.py", "{output}"], "depends_on": ["clean"]}
+      ]
+    }
+
+A task runs either a `command` (a shell string or an argument list; `{input}`,
+`{output}` and `{task}` are substituted and any other braces are left as they
+are) or a `callable` given as
+"module:function", which is called with `input`, `output` and the task's
+`args` as keyword arguments (on the thread pool, a callable with a `timeout`
+runs in a child process so it can be stopped). Tasks downstream of a failed
+task are skipped.
+
+With a `cache_dir` (or --cache-dir), results are cached: a task whose code,
+config, `inputs` and upstream tasks are unchanged since a successful run is
+skipped and its result reused, as long as its `outputs` are still on disk.
+Tasks without `inputs` are treated as reading everything under `{input}`.
+Inputs are fingerprinted by size and mtime, or by content with
+`"content_hash": true`. Set `"cache_outputs": true` to keep copies of outputs
+in the cache so they can be restored, and `"cache": false` on tasks that must
+always run (which also re-runs everything downstream of them):
+
+    {"name": "clean", "callable": "transforms:clean", "depends_on": ["extract"],
+     "inputs": ["staging/*.parquet"], "outputs": ["clean/"], "content_hash": true}
 """
 
 import os
+import re
 import sys
+import glob
 import json
+import shlex
+import uuid
+import shutil
+import signal
+import hashlib
 import logging
 import argparse
+import multiprocessing
+import importlib
+import importlib.util
+import subprocess
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
 from typing import Dict, List, Optional
 from datetime import datetime
 
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+EXECUTORS = {'thread': ThreadPoolExecutor, 'process': ProcessPoolExecutor}
+
+# The placeholders substituted in commands and in `inputs`/`outputs` patterns
+PLACEHOLDER_PATTERN = re.compile(r'\{(input|output|task)\}')
+
+
+class TaskTimeout(Exception):
+    """Raised when a task attempt runs longer than its timeout"""
+
+
+def load_config(path: str) -> Dict:
+    """Load a pipeline config from a JSON or YAML file"""
+    with open(path) as f:
+        if Path(path).suffix.lower() in ('.yaml', '.yml'):
+            if yaml is None:
+                raise RuntimeError("PyYAML is required for YAML configs (pip install pyyaml)")
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+def topological_order(tasks: List[Dict]) -> List[str]:
+    """Return task names in dependency order; raises ValueError on cycles"""
+    dependents = {task['name']: [] for task in tasks}
+    remaining = {task['name']: len(task.get('depends_on', [])) for task in tasks}
+    for task in tasks:
+        for dependency in task.get('depends_on', []):
+            dependents[dependency].append(task['name'])
+    
+    ready = [name for name, count in remaining.items() if count == 0]
+    order = []
+    while ready:
+        name = ready.pop(0)
+        order.append(name)
+        for dependent in dependents[name]:
+            remaining[dependent] -= 1
+            if remaining[dependent] == 0:
+                ready.append(dependent)
+    
+    if len(order) != len(tasks):
+        cyclic = sorted(name for name, count in remaining.items() if count > 0)
+        raise ValueError(f"Dependency cycle between tasks: {', '.join(cyclic)}")
+    return order
+
+
+def substitute(template: str, context: Dict) -> str:
+    """Replace `{input}`, `{output}` and `{task}` in a string, leaving other braces alone"""
+    return PLACEHOLDER_PATTERN.sub(lambda match: str(context[match.group(1)]), template)
+
+
+def _raise_timeout(signum, frame):
+    raise TaskTimeout()
+
+
+def _resolve_callable(spec: str):
+    module_name, _, function_name = spec.partition(':')
+    if not function_name:
+        raise ValueError(f"Callable must be given as 'module:function', got {spec!r}")
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def _run_attempt(task: Dict, context: Dict):
+    """Run one attempt of a task and return its result"""
+    timeout = task.get('timeout')
+    if 'command' in task:
+        command = task['command']
+        if isinstance(command, str):
+            command = substitute(command, context)
+        else:
+            command = [substitute(str(arg), context) for arg in command]
+        try:
+            completed = subprocess.run(
+                command, shell=isinstance(command, str), capture_output=True, text=True, timeout=timeout
+            )
+        except subprocess.TimeoutExpired:
+            raise TaskTimeout()
+        if completed.returncode != 0:
+            raise RuntimeError(f"exit status {completed.returncode}: {completed.stderr.strip()[-500:]}")
+        return completed.stdout.strip()[-1000:] or None
+    
+    kwargs = {'input': context['input'], 'output': context['output'], **task.get('args', {})}
+    # Callables can only be interrupted from the main thread of a process, which is where
+    # process pool workers run them. On the thread pool, a callable with a timeout runs in a
+    # child process instead, which is killed when the timeout expires.
+    if timeout and threading.current_thread() is not threading.main_thread():
+        return _call_in_subprocess(task['callable'], kwargs, timeout)
+    function = _resolve_callable(task['callable'])
+    if timeout:
+        previous = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return function(**kwargs)
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+def _subprocess_entry(spec: str, kwargs: Dict, connection):
+    try:
+        value = _resolve_callable(spec)(**kwargs)
+    except BaseException as e:
+        try:
+            connection.send((False, e))
+        except Exception:
+            connection.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+        return
+    try:
+        connection.send((True, value))
+    except Exception:
+        # Results that can't be pickled are reported by their repr, as run_task does for JSON
+        connection.send((True, repr(value)))
+
+
+def _call_in_subprocess(spec: str, kwargs: Dict, timeout: float):
+    """Call a "module:function" callable in a child process, killing it after `timeout` seconds"""
+    # Spawned rather than forked: forking a process that is running other threads can leave
+    # locks held in the child
+    mp_context = multiprocessing.get_context('spawn')
+    receiver, sender = mp_context.Pipe(duplex=False)
+    process = mp_context.Process(target=_subprocess_entry, args=(spec, kwargs, sender), daemon=True)
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            raise TaskTimeout()
+        try:
+            succeeded, value = receiver.recv()
+        except EOFError:
+            process.join()
+            raise RuntimeError(f"callable process exited with code {process.exitcode}")
+        if not succeeded:
+            raise value
+        return value
+    finally:
+        receiver.close()
+        if process.is_alive():
+            process.kill()
+        process.join()
+
+
+def run_task(task: Dict, context: Dict) -> Dict:
+    """Run a task with retries; runs on the worker pool and returns its outcome"""
+    retries = task.get('retries', 0)
+    retry_delay = task.get('retry_delay', 1.0)
+    started = time.monotonic()
+    error = None
+    for attempt in range(1, retries + 2):
+        try:
+            value = _run_attempt(task, context)
+            try:
+                json.dumps(value)
+            except (TypeError, ValueError):
+                value = repr(value)
+            return {
+                'status': 'succeeded',
+                'attempts': attempt,
+                'duration_s': round(time.monotonic() - started, 3),
+                'result': value,
+            }
+        except TaskTimeout:
+            error = f"timed out after {task.get('timeout')}s"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        if attempt <= retries:
+            time.sleep(retry_delay * 2 ** (attempt - 1))
+    return {
+        'status': 'failed',
+        'attempts': retries + 1,
+        'duration_s': round(time.monotonic() - started, 3),
+        'error': error,
+    }
+
+
+def expand_paths(patterns: List[str]) -> List[str]:
+    """Expand globs and directories into a sorted list of files"""
+    files = set()
+    for pattern in patterns:
+        for path in glob.glob(pattern, recursive=True) or [pattern]:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    files.update(os.path.join(root, name) for name in names)
+            else:
+                files.add(path)
+    return sorted(files)
+
+
+def file_fingerprint(path: str, content_hash: bool = False) -> Optional[List]:
+    """Return [size, mtime_ns] for a file, or [size, sha256] with content_hash; None if missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not content_hash:
+        return [st.st_size, st.st_mtime_ns]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return [st.st_size, digest.hexdigest()]
+
+
+class TaskCache:
+    """Cache of task results keyed by a hash of each task's code, config and inputs
+    
+    A task's key also covers the keys of the tasks it depends on, so a change to
+    any input invalidates every task downstream of it. Each entry records the
+    fingerprints of the task's declared `outputs`; a cached result is only used
+    while those outputs are unchanged on disk, or can be restored from copies
+    kept in the cache when `cache_outputs` is set.
+    """
+    
+    # Command arguments with these extensions are hashed as the task's code
+    CODE_EXTENSIONS = ('.py', '.sql', '.sh', '.r', '.scala', '.jar', '.js')
+    
+    # Task settings that don't affect what a task produces
+    NON_SEMANTIC_KEYS = ('retries', 'retry_delay', 'timeout', 'cache', 'cache_outputs', 'depends_on')
+    
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+    
+    @staticmethod
+    def task_paths(task: Dict, field: str, context: Dict) -> List[str]:
+        """Expand a task's `inputs` or `outputs`, which may use `{input}` and `{output}`"""
+        return expand_paths([substitute(pattern, context) for pattern in task.get(field, [])])
+    
+    def code_fingerprint(self, task: Dict) -> str:
+        """Hash the code a task runs: its callable's module or the scripts its command names, plus any `code` files"""
+        digest = hashlib.sha256()
+        code_files = list(task.get('code', []))
+        if 'callable' in task:
+            module_name = task['callable'].partition(':')[0]
+            if os.getcwd() not in sys.path:
+                sys.path.insert(0, os.getcwd())
+            try:
+                spec = importlib.util.find_spec(module_name)
+            except (ImportError, ValueError):
+                spec = None
+            if spec is not None and spec.origin and os.path.isfile(spec.origin):
+                code_files.append(spec.origin)
+        else:
+            command = task['command']
+            arguments = shlex.split(command) if isinstance(command, str) else [str(arg) for arg in command]
+            code_files.extend(arg for arg in arguments if arg.lower().endswith(self.CODE_EXTENSIONS) and os.path.isfile(arg))
+        for path in expand_paths(code_files):
+            digest.update(json.dumps([path, file_fingerprint(path, content_hash=True)]).encode())
+        return digest.hexdigest()
+    
+    def task_key(self, task: Dict, context: Dict, upstream_keys: List[str]) -> str:
+        """Compute the cache key for a task from its code, config, inputs and upstream keys"""
+        content_hash = task.get('content_hash', False)
+        # A task that doesn't declare its inputs is assumed to read everything under `{input}`
+        if 'inputs' not in task:
+            task = {**task, 'inputs': ['{input}']}
+        inputs = [[path, file_fingerprint(path, content_hash)] for path in self.task_paths(task, 'inputs', context)]
+        config = {key: value for key, value in task.items() if key not in self.NON_SEMANTIC_KEYS}
+        material = {
+            'code': self.code_fingerprint(task),
+            'config': config,
+            'context': context,
+            'inputs': inputs,
+            'upstream': upstream_keys,
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True, default=str).encode()).hexdigest()
+    
+    def _entry_dir(self, name: str, key: str) -> str:
+        safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+        return os.path.join(self.cache_dir, safe_name, key)
+    
+    def get(self, task: Dict, key: str, context: Dict) -> Optional[Dict]:
+        """Return the cached outcome for a task, restoring its outputs if needed; None on a miss"""
+        entry_dir = self._entry_dir(task['name'], key)
+        try:
+            with open(os.path.join(entry_dir, 'entry.json')) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        try:
+            changed = [
+                path for path, fingerprint in entry['outputs'].items()
+                if file_fingerprint(path) != fingerprint
+            ]
+            if changed:
+                stored_dir = os.path.join(entry_dir, 'outputs')
+                if not entry.get('stored_outputs'):
+                    logger.info(f"Cache entry for {task['name']} is stale: {len(changed)} output file(s) changed")
+                    return None
+                for path in changed:
+                    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                    shutil.copy2(os.path.join(stored_dir, entry['stored_outputs'][path]), path)
+                logger.info(f"Restored {len(changed)} output file(s) of {task['name']} from the cache")
+            return dict(entry['outcome'])
+        except Exception as e:
+            # A corrupt or partly deleted entry is a miss; the task runs and overwrites it
+            logger.warning(f"Ignoring unusable cache entry for {task['name']}: {type(e).__name__}: {e}")
+            return None
+    
+    def put(self, task: Dict, key: str, context: Dict, outcome: Dict, store_outputs: bool = False):
+        """Record a successful outcome and the fingerprints of the task's outputs"""
+        entry_dir = self._entry_dir(task['name'], key)
+        os.makedirs(entry_dir, exist_ok=True)
+        outputs = self.task_paths(task, 'outputs', context)
+        entry = {
+            'key': key,
+            'created': datetime.now().isoformat(),
+            'outcome': outcome,
+            'outputs': {path: file_fingerprint(path) for path in outputs},
+        }
+        if store_outputs:
+            stored_dir = os.path.join(entry_dir, 'outputs')
+            os.makedirs(stored_dir, exist_ok=True)
+            entry['stored_outputs'] = {}
+            for index, path in enumerate(outputs):
+                if os.path.isfile(path):
+                    stored_name = f"{index}_{os.path.basename(path)}"
+                    shutil.copy2(path, os.path.join(stored_dir, stored_name))
+                    entry['stored_outputs'][path] = stored_name
+        tmp_path = os.path.join(entry_dir, f"entry.json.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, os.path.join(entry_dir, 'entry.json'))
+
+
+def run_cached_task(task: Dict, context: Dict, cache_dir: str, upstream_keys: List[str], store_outputs: bool = False) -> Dict:
+    """Reuse a task's cached result or run it and cache the outcome; runs on the worker pool
+    
+    Hashing inputs and restoring outputs happen here rather than on the scheduler
+    thread, so they overlap with other tasks. The outcome carries the task's
+    `cache_key` for the tasks downstream of it.
+    """
+    cache = TaskCache(cache_dir)
+    try:
+        key = cache.task_key(task, context, upstream_keys)
+    except Exception as e:
+        logger.warning(f"Could not compute a cache key for {task['name']}; running it uncached: {type(e).__name__}: {e}")
+        return {**run_task(task, context), 'cache_key': uuid.uuid4().hex}
+    outcome = cache.get(task, key, context)
+    if outcome is not None:
+        return {**outcome, 'status': 'cached', 'cache_key': key}
+    outcome = run_task(task, context)
+    if outcome['status'] == 'succeeded':
+        try:
+            cache.put(task, key, context, outcome, store_outputs)
+        except OSError as e:
+            logger.warning(f"Could not cache the result of {task['name']}: {e}")
+    return {**outcome, 'cache_key': key}
+
+
 class PipelineOrchestrator:
     """Production-grade pipeline orchestrator"""
     
@@ -34,7 +439,29 @@ class PipelineOrchestrator:
     def validate_config(self) -> bool:
         """Validate configuration"""
         logger.info("Validating configuration...")
-        # Add validation logic
+        tasks = self.config.get('tasks', [])
+        if not isinstance(tasks, list):
+            raise ValueError("'tasks' must be a list")
+        names = set()
+        for task in tasks:
+            name = task.get('name')
+            if not name:
+                raise ValueError(f"Task without a name: {task}")
+            if name in names:
+                raise ValueError(f"Duplicate task name: {name}")
+            names.add(name)
+            if ('command' in task) == ('callable' in task):
+                raise ValueError(f"Task {name} needs exactly one of 'command' or 'callable'")
+        for task in tasks:
+            for dependency in task.get('depends_on', []):
+                if dependency not in names:
+                    raise ValueError(f"Task {task['name']} depends on unknown task {dependency}")
+        
+        executor = self.config.get('executor', 'thread')
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor {executor!r}; use one of {', '.join(EXECUTORS)}")
+        
+        topological_order(tasks)
         logger.info("Configuration validated")
         return True
     
@@ -61,8 +488,89 @@ class PipelineOrchestrator:
             raise
     
     def _execute(self) -> Dict:
-        """Execute main logic"""
-        # Implementation here
+        """Run the task DAG, starting each task as soon as its dependencies succeed"""
+        tasks = {task['name']: task for task in self.config.get('tasks', [])}
+        order = topological_order(list(tasks.values()))
+        dependents = {name: [] for name in tasks}
+        waiting_on = {}
+        for name, task in tasks.items():
+            waiting_on[name] = set(task.get('depends_on', []))
+            for dependency in waiting_on[name]:
+                dependents[dependency].append(name)
+        
+        task_results = {}
+        self.results['tasks'] = task_results
+        self.results['cached_items'] = 0
+        cache_dir = self.config.get('cache_dir')
+        cache = TaskCache(cache_dir) if cache_dir else None
+        keys = {}
+        executor_class = EXECUTORS[self.config.get('executor', 'thread')]
+        max_workers = self.config.get('max_workers')
+        
+        def task_context(name):
+            return {'input': self.config.get('input'), 'output': self.config.get('output'), 'task': name}
+        
+        def skip_downstream(name):
+            for dependent in dependents[name]:
+                if dependent not in task_results:
+                    task_results[dependent] = {'status': 'skipped', 'error': f"upstream task {name} failed"}
+                    logger.warning(f"Skipping {dependent}: upstream task {name} failed")
+                    skip_downstream(dependent)
+        
+        with executor_class(max_workers=max_workers) as executor:
+            running = {}
+            
+            def complete(name, outcome):
+                task_results[name] = outcome
+                if outcome['status'] in ('succeeded', 'cached'):
+                    for dependent in dependents[name]:
+                        waiting_on[dependent].discard(name)
+                else:
+                    skip_downstream(name)
+            
+            def submit(name):
+                task = tasks[name]
+                context = task_context(name)
+                if cache is None:
+                    future = executor.submit(run_task, task, context)
+                elif not task.get('cache', True):
+                    # Tasks that always run invalidate everything downstream of them
+                    keys[name] = uuid.uuid4().hex
+                    future = executor.submit(run_task, task, context)
+                else:
+                    upstream_keys = [keys[dependency] for dependency in sorted(task.get('depends_on', []))]
+                    store_outputs = task.get('cache_outputs', self.config.get('cache_outputs', False))
+                    future = executor.submit(run_cached_task, task, context, cache_dir, upstream_keys, store_outputs)
+                running[future] = name
+            
+            def submit_ready():
+                for name in order:
+                    if name not in task_results and name not in running.values() and not waiting_on[name]:
+                        logger.info(f"Starting task {name}")
+                        submit(name)
+            
+            submit_ready()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    outcome = future.result()
+                    if 'cache_key' in outcome:
+                        keys[name] = outcome['cache_key']
+                    if outcome['status'] == 'cached':
+                        logger.info(f"Task {name} is unchanged; reused cached result")
+                        self.results['cached_items'] += 1
+                    elif outcome['status'] == 'succeeded':
+                        logger.info(f"Task {name} succeeded in {outcome['duration_s']}s ({outcome['attempts']} attempt(s))")
+                        self.results['processed_items'] += 1
+                    else:
+                        logger.error(f"Task {name} failed after {outcome['attempts']} attempt(s): {outcome['error']}")
+                    complete(name, outcome)
+                submit_ready()
+        
+        failed = [name for name in order if task_results[name]['status'] not in ('succeeded', 'cached')]
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(order)} tasks did not succeed: {', '.join(failed)}")
         return {'success': True}
 
 def main():
@@ -73,6 +581,10 @@ def main():
     parser.add_argument('--input', '-i', required=True, help='Input path')
     parser.add_argument('--output', '-o', required=True, help='Output path')
     parser.add_argument('--config', '-c', help='Configuration file')
+    parser.add_argument('--executor', choices=sorted(EXECUTORS), help='Run tasks on a thread or process pool')
+    parser.add_argument('--workers', '-w', type=int, help='Maximum number of tasks to run at once')
+    parser.add_argument('--cache-dir', help='Cache task results here and skip unchanged tasks')
+    parser.add_argument('--no-cache', action='store_true', help='Run every task, ignoring any cache_dir in the config')
     parser.add_argument('--verbose', '-v', action='store_true', help='Verbose output')
     
     args = parser.parse_args()
@@ -80,11 +592,21 @@ def main():
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
     
+    processor = None
     try:
-        config = {
+        config = load_config(args.config) if args.config else {}
+        config.update({
             'input': args.input,
             'output': args.output
-        }
+        })
+        if args.executor:
+            config['executor'] = args.executor
+        if args.workers:
+            config['max_workers'] = args.workers
+        if args.cache_dir:
+            config['cache_dir'] = args.cache_dir
+        if args.no_cache:
+            config.pop('cache_dir', None)
         
         processor = PipelineOrchestrator(config)
         results = processor.process()
@@ -94,6 +616,8 @@ def main():
         
     except Exception as e:
         logger.error(f"Fatal error: {e}")
+        if processor is not None:
+            print(json.dumps(processor.results, indent=2))
         sys.exit(1)
 
 if __name__ == '__main__':
@@ -0,0 +1,211 @@
+import unittest
+import glob
+import logging
+import os
+import tempfile
+from pipeline_orchestrator import (
+    PipelineOrchestrator,
+    TaskCache,
+    run_task,
+    substitute,
+    topological_order,
+)
+
+
+def run_pipeline(tasks, **config):
+    """Helper to run a pipeline and return its results, whether or not every task succeeded"""
+    orchestrator = PipelineOrchestrator({'tasks': tasks, **config})
+    try:
+        orchestrator.process()
+    except RuntimeError:
+        pass
+    return orchestrator.results
+
+
+# Currently this is not run automatically in CI; it's just for documentation and manual checking.
+class TestTopologicalOrder(unittest.TestCase):
+
+    def test_dependencies_come_first(self):
+        tasks = [
+            {'name': 'load', 'depends_on': ['clean']},
+            {'name': 'clean', 'depends_on': ['extract']},
+            {'name': 'extract'},
+        ]
+        self.assertEqual(topological_order(tasks), ['extract', 'clean', 'load'])
+
+    def test_cycle_is_rejected(self):
+        tasks = [
+            {'name': 'a', 'depends_on': ['c']},
+            {'name': 'b', 'depends_on': ['a']},
+            {'name': 'c', 'depends_on': ['b']},
+            {'name': 'd'},
+        ]
+        with self.assertRaises(ValueError) as cm:
+            topological_order(tasks)
+        self.assertIn('a, b, c', str(cm.exception))
+
+
+class TestRunPipeline(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def test_downstream_of_failure_is_skipped(self):
+        results = run_pipeline([
+            {'name': 'extract', 'command': 'true'},
+            {'name': 'clean', 'command': 'false', 'depends_on': ['extract']},
+            {'name': 'load', 'command': 'true', 'depends_on': ['clean']},
+            {'name': 'report', 'command': 'true', 'depends_on': ['load']},
+            {'name': 'audit', 'command': 'true', 'depends_on': ['extract']},
+        ])
+        statuses = {name: result['status'] for name, result in results['tasks'].items()}
+        self.assertEqual(statuses, {
+            'extract': 'succeeded',
+            'clean': 'failed',
+            'load': 'skipped',
+            'report': 'skipped',
+            'audit': 'succeeded',
+        })
+        self.assertEqual(results['status'], 'failed')
+
+    def test_retries_until_success(self):
+        attempts_file = os.path.join(self.dir, 'attempts')
+        # Fails on the first two attempts
+        command = f"echo x >> {attempts_file}; test $(wc -l < {attempts_file}) -ge 3"
+        outcome = run_task({'name': 'flaky', 'command': command, 'retries': 3, 'retry_delay': 0}, {})
+        self.assertEqual(outcome['status'], 'succeeded')
+        self.assertEqual(outcome['attempts'], 3)
+
+    def test_gives_up_after_retries(self):
+        outcome = run_task({'name': 'broken', 'command': 'exit 3', 'retries': 2, 'retry_delay': 0}, {})
+        self.assertEqual(outcome['status'], 'failed')
+        self.assertEqual(outcome['attempts'], 3)
+        self.assertIn('exit status 3', outcome['error'])
+
+    def test_command_timeout(self):
+        outcome = run_task({'name': 'slow', 'command': 'sleep 5', 'timeout': 0.2}, {})
+        self.assertEqual(outcome['status'], 'failed')
+        self.assertIn('timed out', outcome['error'])
+
+
+class TestPlaceholders(unittest.TestCase):
+
+    def test_only_known_placeholders_are_substituted(self):
+        context = {'input': 'in.txt', 'output': 'out.txt', 'task': 'count'}
+        self.assertEqual(
+            substitute("awk '{print $1}' {input} > {output} # {task} ${HOME} {\"k\": 1} {other}", context),
+            "awk '{print $1}' in.txt > out.txt # count ${HOME} {\"k\": 1} {other}",
+        )
+
+    def test_command_with_braces_runs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'a.txt')
+            target = os.path.join(tmp, 'b.txt')
+            with open(source, 'w') as f:
+                f.write('a b\nc d\n')
+            context = {'input': source, 'output': target, 'task': 'first'}
+            outcome = run_task({'name': 'first', 'command': "awk '{print $1}' {input} > {output}"}, context)
+            self.assertEqual(outcome['status'], 'succeeded', outcome.get('error'))
+            with open(target) as f:
+                self.assertEqual(f.read(), 'a\nc\n')
+
+    def test_argument_list_with_braces(self):
+        context = {'input': 'in', 'output': 'out', 'task': 'echo'}
+        outcome = run_task({'name': 'echo', 'command': ['echo', '{task}', '{x}', '${HOME}']}, context)
+        self.assertEqual(outcome['result'], 'echo {x} ${HOME}')
+
+
+class TestTaskCache(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.input_dir = os.path.join(self.dir, 'in')
+        os.makedirs(self.input_dir)
+        self.write('in/data.txt', '1\n2\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, name, text):
+        with open(self.path(name), 'w') as f:
+            f.write(text)
+
+    def read(self, name):
+        with open(self.path(name)) as f:
+            return f.read()
+
+    def run_cached(self, tasks):
+        results = run_pipeline(tasks, input=self.input_dir, output=self.path('out'), cache_dir=self.path('cache'))
+        return {name: result['status'] for name, result in results['tasks'].items()}
+
+    def pipeline(self):
+        """Helper for a two-task pipeline: `count` reads the input data, `double` reads its output"""
+        count = self.path('count.txt')
+        double = self.path('double.txt')
+        return [
+            {'name': 'count', 'command': f"wc -l < {{input}}/data.txt > {count}",
+             'inputs': ['{input}/data.txt'], 'outputs': [count]},
+            {'name': 'double', 'command': f"echo $(( $(cat {count}) * 2 )) > {double}",
+             'depends_on': ['count'], 'inputs': [count], 'outputs': [double]},
+        ]
+
+    def test_unchanged_pipeline_is_a_hit(self):
+        self.assertEqual(self.run_cached(self.pipeline()), {'count': 'succeeded', 'double': 'succeeded'})
+        self.assertEqual(self.run_cached(self.pipeline()), {'count': 'cached', 'double': 'cached'})
+        self.assertEqual(self.read('double.txt').strip(), '4')
+
+    def test_changed_upstream_input_reruns_downstream(self):
+        self.run_cached(self.pipeline())
+        self.write('in/data.txt', '1\n2\n3\n')
+        self.assertEqual(self.run_cached(self.pipeline()), {'count': 'succeeded', 'double': 'succeeded'})
+        self.assertEqual(self.read('double.txt').strip(), '6')
+
+    def test_changed_config_is_a_miss(self):
+        self.run_cached(self.pipeline())
+        tasks = self.pipeline()
+        tasks[1]['command'] += ' # changed'
+        self.assertEqual(self.run_cached(tasks), {'count': 'cached', 'double': 'succeeded'})
+
+    def test_deleted_output_is_a_miss(self):
+        self.run_cached(self.pipeline())
+        os.remove(self.path('double.txt'))
+        self.assertEqual(self.run_cached(self.pipeline()), {'count': 'cached', 'double': 'succeeded'})
+        self.assertEqual(self.read('double.txt').strip(), '4')
+
+    def test_task_without_inputs_is_keyed_on_input(self):
+        count = self.path('count.txt')
+        tasks = [{'name': 'count', 'command': f"wc -l < {{input}}/data.txt > {count}", 'outputs': [count]}]
+        self.run_cached(tasks)
+        self.write('in/data.txt', '1\n2\n3\n')
+        self.assertEqual(self.run_cached(tasks), {'count': 'succeeded'})
+        self.assertEqual(self.read('count.txt').strip(), '3')
+
+    def test_corrupt_entry_is_a_miss(self):
+        self.run_cached(self.pipeline())
+        for entry in glob.glob(self.path('cache/count/*/entry.json')):
+            self.write(entry, '{"outputs": []}')
+        self.assertEqual(self.run_cached(self.pipeline())['count'], 'succeeded')
+        self.assertEqual(self.read('count.txt').strip(), '2')
+
+    def test_key_covers_upstream_keys(self):
+        cache = TaskCache(self.path('cache'))
+        task = {'name': 'double', 'command': 'true', 'inputs': []}
+        context = {'input': self.input_dir, 'output': None, 'task': 'double'}
+        self.assertEqual(cache.task_key(task, context, ['a']), cache.task_key(task, context, ['a']))
+        self.assertNotEqual(cache.task_key(task, context, ['a']), cache.task_key(task, context, ['b']))
+
+
+if __name__ == '__main__':
+    unittest.main()